@@ -1,8 +1,14 @@
+import sys
+
 from .cli import cli
 from .config import default_config
+from .daemon import forward
 
 
 def main():
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
     cli(obj=default_config)
 
 
@@ -1,44 +1,73 @@
-import click
+import importlib
+
 from .colorize import HelpColorsGroup
 
 
+ALIASES = {
+    'svc': 'service',
+    'services': 'service',
+    'no': 'container-instance',
+    'node': 'container-instance',
+    'nodes': 'container-instance',
+    'container-instances': 'container-instance',
+    'clusters': 'cluster',
+    'task-definitions': 'task-definition',
+    'td': 'task-definition',
+    'taskdef': 'task-definition',
+    'taskdefs': 'task-definition',
+    'tdf': 'task-definition-family',
+    'task-definition-families': 'task-definition-family',
+    'taskdef-family': 'task-definition-family',
+    'taskdef-families': 'task-definition-family',
+    'po': 'task',
+    'pod': 'task',
+    'pods': 'task',
+    'ta': 'task',
+    'tasks': 'task',
+    'log': 'logs',
+    'alb': 'loadbalancer',
+    'lb': 'loadbalancer',
+    'hz': 'hosted-zones',
+    '53': 'hosted-zones',
+    'zone': 'hosted-zones',
+    'route53': 'hosted-zones',
+    'cw': 'cloudwatch'
+}
+
+
 class AliasedGroup(HelpColorsGroup):
 
     def get_command(self, ctx, cmd_name):
-        rv = click.Group.get_command(self, ctx, cmd_name)
+        rv = super(AliasedGroup, self).get_command(ctx, cmd_name)
         if rv is not None:
             return rv
-        mapping = {
-            'svc': 'service',
-            'services': 'service',
-            'no': 'container-instance',
-            'node': 'container-instance',
-            'nodes': 'container-instance',
-            'container-instances': 'container-instance',
-            'clusters': 'cluster',
-            'task-definitions': 'task-definition',
-            'td': 'task-definition',
-            'taskdef': 'task-definition',
-            'taskdefs': 'task-definition',
-            'tdf': 'task-definition-family',
-            'task-definition-families': 'task-definition-family',
-            'taskdef-family': 'task-definition-family',
-            'taskdef-families': 'task-definition-family',
-            'po': 'task',
-            'pod': 'task',
-            'pods': 'task',
-            'ta': 'task',
-            'tasks': 'task',
-            'log': 'logs',
-            'alb': 'loadbalancer',
-            'lb': 'loadbalancer',
-            'hz': 'hosted-zones',
-            '53': 'hosted-zones',
-            'zone': 'hosted-zones',
-            'route53': 'hosted-zones',
-            'cw': 'cloudwatch'
-        }
-        if cmd_name in mapping:
-            rv = click.Group.get_command(self, ctx, mapping[cmd_name])
+        if cmd_name in ALIASES:
+            rv = super(AliasedGroup, self).get_command(ctx, ALIASES[cmd_name])
             if rv is not None:
                 return rv
+
+
+class LazyGroup(AliasedGroup):
+    """Group whose subcommands are imported only when they are invoked.
+
+    `lazy_commands` maps a command name to `'module:attribute'`; the module is
+    resolved relative to the package the group is defined in.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        for name in (cmd_name, ALIASES.get(cmd_name)):
+            if name in self.lazy_commands and name not in self.commands:
+                self.add_command(self._load(name), name)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+    def _load(self, cmd_name):
+        module_name, _, attribute = self.lazy_commands[cmd_name].partition(':')
+        module = importlib.import_module(module_name, __package__)
+        return getattr(module, attribute)
@@ -0,0 +1,211 @@
+import os
+import re
+import gzip
+import json
+import mmap
+import bisect
+import struct
+import hashlib
+import tempfile
+from urllib.parse import quote, unquote
+
+from .config import APP_DIR
+
+__all__ = ['ARCHIVE_DIR', 'StreamArchive', 'archived_streams', 'export_stream']
+
+
+ARCHIVE_DIR = os.path.join(APP_DIR, 'archive')
+# Events per compressed segment file.
+SEGMENT_EVENTS = 10000
+# One record per segment: first timestamp, last timestamp, segment number.
+INDEX_RECORD = struct.Struct('<qqq')
+
+
+def _digest(event):
+    return hashlib.sha1('{}\0{}'.format(event['timestamp'], event['message']).encode('utf-8')).hexdigest()
+
+
+def _atomic_write(directory, path, write, mode='w'):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class _LastTimestamps:
+    """Sequence view of the last timestamps in a memory-mapped index, for `bisect`."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer) // INDEX_RECORD.size
+
+    def __getitem__(self, i):
+        return INDEX_RECORD.unpack_from(self.buffer, i * INDEX_RECORD.size)[1]
+
+
+class StreamArchive:
+    """Local copy of one CloudWatch log stream.
+
+    Events are kept in gzip-compressed JSON-lines segments which never
+    overlap in time. `index` holds one fixed-size record per segment, sorted
+    by time, so a time range query maps the file and bisects it to find the
+    segments to decompress. `state.json` remembers the covered range and the
+    events at its newest timestamp, so the next export only appends events
+    CloudWatch received after it.
+    """
+
+    def __init__(self, group, stream, directory=ARCHIVE_DIR):
+        self.group = group
+        self.stream = stream
+        self.directory = os.path.join(directory, quote(group, safe=''), quote(stream, safe=''))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def state(self):
+        try:
+            with open(self._path('state.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_state(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        _atomic_write(self.directory, self._path('state.json'), lambda f: json.dump(state, f))
+
+    def _index_records(self):
+        try:
+            with open(self._path('index'), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return []
+        return [INDEX_RECORD.unpack_from(data, offset) for offset in range(0, len(data), INDEX_RECORD.size)]
+
+    def _write_segment(self, events, records):
+        number = max([record[2] for record in records], default=0) + 1
+
+        def write(f):
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                for event in events:
+                    gz.write(json.dumps({'timestamp': event['timestamp'], 'message': event['message']}).encode('utf-8'))
+                    gz.write(b'\n')
+
+        _atomic_write(self.directory, self._path('{:08d}.jsonl.gz'.format(number)), write, 'wb')
+        records.append((events[0]['timestamp'], events[-1]['timestamp'], number))
+
+    def write(self, events):
+        """Store `events` (in timestamp order, outside the range already archived). Returns their count."""
+        os.makedirs(self.directory, exist_ok=True)
+        records, batch, count = self._index_records(), [], 0
+        for event in events:
+            batch.append(event)
+            if len(batch) >= SEGMENT_EVENTS:
+                self._write_segment(batch, records)
+                count, batch = count + len(batch), []
+        if batch:
+            self._write_segment(batch, records)
+            count += len(batch)
+        if count:
+            records.sort()
+            _atomic_write(self.directory, self._path('index'),
+                          lambda f: f.write(b''.join(INDEX_RECORD.pack(*record) for record in records)), 'wb')
+        return count
+
+    def segments(self, start_time=None, end_time=None):
+        """Segment numbers which may hold events in `[start_time, end_time)`."""
+        try:
+            f = open(self._path('index'), 'rb')
+        except OSError:
+            return []
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                lo = 0 if start_time is None else bisect.bisect_left(_LastTimestamps(buffer), start_time)
+                numbers = []
+                for i in range(lo, len(buffer) // INDEX_RECORD.size):
+                    first, _, number = INDEX_RECORD.unpack_from(buffer, i * INDEX_RECORD.size)
+                    if end_time is not None and first >= end_time:
+                        break
+                    numbers.append(number)
+        return numbers
+
+    def read(self, start_time=None, end_time=None, pattern=None):
+        """Events in `[start_time, end_time)`, oldest first, whose message matches `pattern`."""
+        regex = re.compile(pattern) if pattern else None
+        for number in self.segments(start_time, end_time):
+            with gzip.open(self._path('{:08d}.jsonl.gz'.format(number)), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    event = json.loads(line)
+                    if start_time is not None and event['timestamp'] < start_time:
+                        continue
+                    if end_time is not None and event['timestamp'] >= end_time:
+                        break
+                    if regex and not regex.search(event['message']):
+                        continue
+                    event['logStreamName'] = self.stream
+                    yield event
+
+
+def archived_streams(directory=ARCHIVE_DIR, group=None, prefix='', suffix=''):
+    """Archived streams of `group` (or of every group) whose name starts with `prefix` and ends with `suffix`."""
+    try:
+        groups = [quote(group, safe='')] if group else sorted(os.listdir(directory))
+    except OSError:
+        return []
+    archives = []
+    for group_dir in groups:
+        try:
+            stream_dirs = sorted(os.listdir(os.path.join(directory, group_dir)))
+        except OSError:
+            continue
+        for stream_dir in stream_dirs:
+            stream = unquote(stream_dir)
+            if stream.startswith(prefix) and stream.endswith(suffix):
+                archives.append(StreamArchive(unquote(group_dir), stream, directory))
+    return archives
+
+
+def export_stream(fetch, archive, start_time, end_time=None):
+    """Bring `archive` up to date for `[start_time, end_time)`.
+
+    `fetch(start_time, end_time)` returns the stream's events in that range,
+    oldest first. Only the part before the archived range and the part after
+    its newest event are downloaded. Returns the number of new events.
+    """
+    state = archive.state
+    count = 0
+    if state is None:
+        state = {'start': start_time, 'last': start_time, 'boundary': []}
+        ranges = [(start_time, end_time)]
+    else:
+        ranges = []
+        if start_time < state['start']:
+            ranges.append((start_time, state['start']))
+        if end_time is None or end_time > state['last']:
+            ranges.append((state['last'], end_time))
+
+    for start, end in ranges:
+        boundary = set(state['boundary']) if start == state['last'] else set()
+
+        def new_events():
+            for event in fetch(start, end):
+                if event['timestamp'] == state['last'] and _digest(event) in boundary:
+                    continue
+                if event['timestamp'] > state['last']:
+                    state['last'], state['boundary'] = event['timestamp'], []
+                if event['timestamp'] == state['last']:
+                    state['boundary'].append(_digest(event))
+                yield event
+
+        count += archive.write(new_events())
+        state['start'] = min(state['start'], start)
+        archive.save_state(state)
+    return count
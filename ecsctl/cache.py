@@ -0,0 +1,129 @@
+import os
+import json
+import copy
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+from datetime import datetime
+
+from .config import APP_DIR
+
+__all__ = ['Cache', 'CACHE_DIR']
+
+
+CACHE_DIR = os.path.join(APP_DIR, 'cache')
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+MEMO_MAX_ITEMS = 512
+
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    raise TypeError
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class Cache:
+    """Small key/value store with an in-process memo in front of JSON files.
+
+    Files live in `CACHE_DIR/<namespace>` and are named after the SHA-256 of
+    the key. Reading a file refreshes its mtime, and when the namespace grows
+    over `max_bytes` the least recently used files are removed. Values are
+    deep-copied in and out so callers can change them freely.
+    """
+
+    def __init__(self, namespace, enabled=True, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES,
+                 memo_size=MEMO_MAX_ITEMS):
+        self.enabled = enabled
+        self.directory = os.path.join(directory, namespace)
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return copy.deepcopy(self._memo[key])
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f, object_hook=_decode)
+            os.utime(path)
+        except (OSError, ValueError):
+            return default
+        self._remember(key, value)
+        return copy.deepcopy(value)
+
+    def memo(self, key, value):
+        """Keep `value` for this process only."""
+        if self.enabled:
+            self._remember(key, copy.deepcopy(value))
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self.memo(key, value)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f, default=_encode)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._memo.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        try:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
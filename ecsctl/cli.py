@@ -1,36 +1,56 @@
 import click
 
-from . import wrapboto
-
 from .config import read_config
-from .commands import config, cluster, apply, create, update, delete, describe, get, logs, stop, top
-from .colorize import HelpColorsGroup
+from .alias import LazyGroup
+
+
+COMMANDS = {
+    'config': '.commands.config:config',
+    'daemon': '.commands.daemon:daemon',
+    'drain': '.commands.cluster:drain',
+    'undrain': '.commands.cluster:undrain',
+    'run': '.commands.cluster:run',
+    'scale': '.commands.cluster:scale',
+    'exec': '.commands.cluster:exec_command',
+    'create': '.commands.create:create',
+    'apply': '.commands.apply:apply',
+    'update': '.commands.update:update',
+    'delete': '.commands.delete:delete',
+    'describe': '.commands.describe:describe',
+    'get': '.commands.get:get',
+    'logs': '.commands.logs:logs',
+    'stop': '.commands.stop:stop',
+    'top': '.commands.top:top',
+}
+
+
+class LazyBotoWrapper:
+    """Stands in for `wrapboto.BotoWrapper` so boto3 is only imported by commands
+    which talk to AWS."""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._wrapper = None
+
+    def __getattr__(self, name):
+        if self._wrapper is None:
+            from .wrapboto import BotoWrapper
+            self._wrapper = BotoWrapper(**self._kwargs)
+        return getattr(self._wrapper, name)
 
 
-@click.group(cls=HelpColorsGroup)
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+@click.option('--no-cache', is_flag=True, default=False,
+              help="Don't use the local caches of task definitions and AWS service models. "
+                   "The task definition family index is rebuilt and saved.")
 @click.pass_context
-def cli(ctx):
+def cli(ctx, no_cache):
     aws_credentials = {}
     for k, v in read_config(show_temporary=True).items():
         if k in ctx.obj:
             ctx.obj[k] = v
         if str(k).startswith('aws') or str(k).startswith('_aws'):
             aws_credentials[k] = v
-    ctx.obj['bw'] = wrapboto.BotoWrapper(**aws_credentials)
-
-
-cli.add_command(config.config)
-cli.add_command(cluster.drain)
-cli.add_command(cluster.undrain)
-cli.add_command(cluster.run)
-cli.add_command(cluster.scale)
-cli.add_command(cluster.exec_command)
-cli.add_command(create.create)
-cli.add_command(apply.apply)
-cli.add_command(update.update)
-cli.add_command(delete.delete)
-cli.add_command(describe.describe)
-cli.add_command(get.get)
-cli.add_command(logs.logs)
-cli.add_command(stop.stop)
-cli.add_command(top.top)
+    boto_wrapper = ctx.obj.get('boto_wrapper', LazyBotoWrapper)
+    ctx.obj['bw'] = boto_wrapper(
+        max_workers=ctx.obj['max_workers'], use_cache=not no_cache, **aws_credentials)
@@ -1,5 +1,4 @@
 import click
-from .. import wrapboto
 from ..pty import Pty
 from ..colorize import HelpColorsGroup
 
@@ -1,5 +1,4 @@
 import click
-from .. import wrapboto
 from ..config import read_config, update_config, update_context, get_clusters, get_default_context
 from ..colorize import HelpColorsGroup
 
@@ -23,6 +22,8 @@ def config():
 @click.option('--ssh-bastion-user', default="ec2-user", show_default=True)
 @click.option('--ssh-bastion-ip')
 @click.option('--ssh-key-location', default="~/.ssh/id_rsa", show_default=True)
+@click.option('--max-workers', type=int,
+              help="Maximum number of concurrent AWS API calls.")
 @click.pass_context
 def config_set(ctx, name, cluster_name, **kwargs):
     """
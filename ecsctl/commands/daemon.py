@@ -0,0 +1,71 @@
+import click
+
+from .. import daemon as server
+from ..colorize import HelpColorsGroup
+
+
+@click.group(cls=HelpColorsGroup, short_help='Serve commands from a warm background process.')
+def daemon():
+    """
+    \b
+    While the daemon runs, `ecsctl get` and `ecsctl describe` are sent to it
+    over a Unix socket and reuse its AWS sessions, connections and caches.
+    Set ECSCTL_NO_DAEMON=1 to run a command in-process.
+    """
+    pass
+
+
+@daemon.command(name='start', short_help="Start the daemon in the foreground.")
+def daemon_start():
+    """
+    \b
+    # Start the daemon in the foreground
+    cmd::ecsctl daemon start
+
+    \b
+    # Start the daemon in the background
+    cmd::ecsctl daemon start &
+    """
+    try:
+        d = server.Daemon()
+    except OSError as err:
+        click.echo(click.style(str(err), fg='red'))
+        return
+    click.echo('Listening on {}'.format(d.path))
+    try:
+        d.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        d.server_close()
+
+
+@daemon.command(name='stop', short_help="Stop the running daemon.")
+def daemon_stop():
+    """
+    \b
+    # Stop the running daemon
+    cmd::ecsctl daemon stop
+    """
+    try:
+        server.request('stop')
+    except OSError:
+        click.echo(click.style('Daemon is not running.', fg='red'))
+    else:
+        click.echo('Daemon stopped.')
+
+
+@daemon.command(name='status', short_help="Show whether the daemon is running.")
+def daemon_status():
+    """
+    \b
+    # Show whether the daemon is running
+    cmd::ecsctl daemon status
+    """
+    try:
+        status = server.request('ping')
+    except OSError:
+        click.echo(click.style('Daemon is not running.', fg='red'))
+        return
+    click.echo('Daemon is running (pid {pid}, up {uptime}s, {served} commands served, {sessions} sessions).'.format(
+        **status))
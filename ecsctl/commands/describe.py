@@ -6,7 +6,7 @@ import tabulate
 import pprint
 
 from ..alias import AliasedGroup
-from .. import wrapboto, display
+from .. import display
 
 
 @click.group(cls=AliasedGroup, short_help='Show details of a specific resource.')
@@ -97,7 +97,7 @@ def describe_task_definitions(ctx, task_definition, export, output, cluster):
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    task_definition_resp = bw.describe_task_definition(task_definition, cluster=cluster, tags=export)
+    task_definition_resp = bw.describe_task_definition(task_definition, cluster=cluster, tags=export, cached=False)
     if export:
         task_definition_resp, tags = task_definition_resp
         task_definition_resp = bw.strip_task_def_data(task_definition_resp)
@@ -4,16 +4,60 @@ import pprint
 import tabulate
 import datetime
 import humanize
-from jsonpath_ng import parse
 
 from ..alias import AliasedGroup
-from .. import wrapboto, display
+from .. import display, exceptions, filters, query
 
 
 TASK_DEFINITION_STATUS = ['ACTIVE', 'INACTIVE', 'ALL']
 TASK_STATUS = ['RUNNING', 'PENDING', 'STOPPED']
 
 
+class OutputFormat(click.ParamType):
+    """Output choices plus `custom-columns=HEADER:JSONPATH,...`, converted to a list of columns."""
+    name = 'output'
+
+    def __init__(self, choices=()):
+        self.choices = list(choices) + ['custom-columns=...']
+
+    def get_metavar(self, param, ctx=None):
+        return '[{}]'.format('|'.join(self.choices))
+
+    def convert(self, value, param, ctx):
+        if not isinstance(value, str) or value in self.choices[:-1]:
+            return value
+        if value.startswith('custom-columns='):
+            try:
+                return query.parse_custom_columns(value.partition('=')[2])
+            except exceptions.QueryException as err:
+                self.fail(str(err), param, ctx)
+        self.fail('invalid choice: {}. (choose from {})'.format(value, ', '.join(self.choices)), param, ctx)
+
+
+def validate_sort_by(ctx, param, value):
+    try:
+        for expression in (value or '').split(','):
+            if expression.strip():
+                query.SortKey(expression)
+    except exceptions.QueryException as err:
+        raise click.BadParameter(str(err))
+    return value
+
+
+def validate_json_path(ctx, param, value):
+    try:
+        for expression in value:
+            query.Column(expression)
+    except exceptions.QueryException as err:
+        raise click.BadParameter(str(err))
+    return value
+
+
+def echo_custom_columns(records, columns):
+    output = tabulate.tabulate(query.project(records, columns), headers=[c.header for c in columns], tablefmt='plain')
+    click.echo(output)
+
+
 @click.group(cls=AliasedGroup, short_help='Display one or many resources.')
 def get():
     pass
@@ -22,11 +66,14 @@ def get():
 @get.command(name='cluster', short_help="List cluster from your account.")
 @click.option('--quiet', is_flag=True,
               help="Only display name of cluster.")
-@click.option('--sort-by',
-              help="Sort list types using this field specification. The field specification is expressed"
-                   "as a JSONPath expression (e.g. 'settings[*].disabled')")
+@click.option('--sort-by', callback=validate_sort_by,
+              help="Sort list types using this field specification. The field specification is expressed "
+                   "as comma separated JSONPath expressions, prefix one with `-` to sort descending "
+                   "(e.g. 'settings[*].disabled')")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_clusters(ctx, quiet, sort_by):
+def get_clusters(ctx, quiet, sort_by, output):
     """
     \b
     # Get list cluster configured with your AWS account
@@ -39,11 +86,17 @@ def get_clusters(ctx, quiet, sort_by):
     \b
     # Show only name od cluster
     cmd::ecsctl get cluster --quiet
+
+    \b
+    # Show custom columns
+    cmd::ecsctl get cluster -o custom-columns=NAME:.clusterName,SERVICES:.activeServicesCount
     """
     bw = ctx.obj['bw']
     records = bw.get_clusters()
     if sort_by:
-        records.sort(key=lambda r: parse(sort_by).find(r)[0].value)
+        query.sort_records(records, sort_by)
+    if output:
+        return echo_custom_columns(records, output)
     out = []
     for r in records:
         status = r['status']
@@ -67,13 +120,16 @@ def get_clusters(ctx, quiet, sort_by):
 @get.command(name='service', short_help="List services from your cluster.")
 @click.option('--quiet', is_flag=True,
               help="Only display name of service.")
-@click.option('--sort-by',
-              help="Sort list types using this field specification. The field specification is expressed"
-                   "as a JSONPath expression (e.g. 'deployments[*].status')")
+@click.option('--sort-by', callback=validate_sort_by,
+              help="Sort list types using this field specification. The field specification is expressed "
+                   "as comma separated JSONPath expressions, prefix one with `-` to sort descending "
+                   "(e.g. 'deployments[*].status')")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
 @click.pass_context
-def get_services(ctx, quiet, sort_by, cluster):
+def get_services(ctx, quiet, sort_by, output, cluster):
     """
     \b
     # Get list of services provision in default cluster
@@ -94,13 +150,23 @@ def get_services(ctx, quiet, sort_by, cluster):
     \b
     # Get list of services and sort by numbers of running task
     cmd::ecsctl get service --sort-by "runningCount"
+
+    \b
+    # Get list of services sorted by status and then by the most running tasks
+    cmd::ecsctl get service --sort-by "status,-runningCount"
+
+    \b
+    # Get list of services with custom columns
+    cmd::ecsctl get service -o custom-columns=NAME:.serviceName,LAUNCH:.launchType,DESIRED:.desiredCount
     """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
     records = bw.get_services(cluster=cluster)
     if sort_by:
-        records.sort(key=lambda r: parse(sort_by).find(r)[0].value)
+        query.sort_records(records, sort_by)
+    if output:
+        return echo_custom_columns(records, output)
     out = []
     now = datetime.datetime.now(pytz.utc)
     for r in records:
@@ -124,10 +190,11 @@ def get_services(ctx, quiet, sort_by, cluster):
 
 @get.command(name='container-instance', short_help="List container instances from your cluster.")
 @click.option('--quiet', is_flag=True, help="Only display ID of container instance.")
-@click.option('--sort-by',
-              help="Sort list types using this field specification. The field specification is expressed"
-                   "as a JSONPath expression (e.g. 'deployments[*].status')")
-@click.option('-o', '--output', type=click.Choice(['wide']),
+@click.option('--sort-by', callback=validate_sort_by,
+              help="Sort list types using this field specification. The field specification is expressed "
+                   "as comma separated JSONPath expressions, prefix one with `-` to sort descending "
+                   "(e.g. 'deployments[*].status')")
+@click.option('-o', '--output', type=OutputFormat(['wide']),
               help="Output format.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
@@ -161,13 +228,19 @@ def get_container_instance(ctx, cluster, quiet, sort_by, output):
     \b
     # Get list of container instances and sort by registered MEMORY
     cmd::ecsctl get container-instance --sort-by "registeredResources[1].integerValue"
+
+    \b
+    # Get list of container instances with custom columns
+    cmd::ecsctl get container-instance -o custom-columns=EC2:.ec2InstanceId,TYPE:.ec2_data.InstanceType
     """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
     records = bw.get_container_instances(cluster=cluster)
     if sort_by:
-        records.sort(key=lambda r: parse(sort_by).find(r)[0].value)
+        query.sort_records(records, sort_by)
+    if output and output != 'wide':
+        return echo_custom_columns(records, output)
     out = []
     for r in records:
         status = r['status']
@@ -175,7 +248,7 @@ def get_container_instance(ctx, cluster, quiet, sort_by, output):
         container_instance_arn = r['containerInstanceArn']
         instance_id = display.simple_container_instance(container_instance_arn)
         running_count = r['runningTasksCount']
-        private_ip = r['ec2_data']['PrivateIpAddress']
+        private_ip = r['ec2_data'].get('PrivateIpAddress', 'none')
         row = (instance_id,)
         if not quiet:
             row = [instance_id, ec2_instance_id, status, private_ip, running_count]
@@ -192,6 +265,24 @@ def get_container_instance(ctx, cluster, quiet, sort_by, output):
     click.echo(output)
 
 
+def _task_definition_logs(task_definition):
+    c, l = [], []
+    for td in task_definition['containerDefinitions']:
+        c.append(td['name'])
+        log_config = td.get('logConfiguration', {})
+        if log_config.get('logDriver', {}) == 'awslogs':
+            options = log_config.get('options')
+            if options.get('awslogs-group') and \
+                    options.get('awslogs-region') and \
+                    options.get('awslogs-stream-prefix'):
+                l.append('awslogs')
+            else:
+                l.append('none')
+        else:
+            l.append('none')
+    return ' | '.join(l), ' | '.join(c)
+
+
 @get.command(name='task', short_help="List task from your cluster.")
 @click.option('--status', type=click.Choice(TASK_STATUS), default='RUNNING',
               help="Filter task usage status.")
@@ -199,18 +290,22 @@ def get_container_instance(ctx, cluster, quiet, sort_by, output):
               help="Set numbers of items to display.")
 @click.option('--quiet', is_flag=True,
               help="Only display numeric IDs")
-@click.option('--sort-by',
-              help="Sort list types using this field specification. The field specification is expressed"
-                   "as a JSONPath expression (e.g. 'deployments[*].status')")
-@click.option('--jsonpath', 'json_path', multiple=True,
+@click.option('--sort-by', callback=validate_sort_by,
+              help="Sort list types using this field specification. The field specification is expressed "
+                   "as comma separated JSONPath expressions, prefix one with `-` to sort descending "
+                   "(e.g. 'deployments[*].status')")
+@click.option('--jsonpath', 'json_path', multiple=True, callback=validate_json_path,
               help="Filter data from json response and create new column.")
-@click.option('-o', '--output', type=click.Choice(['wide']),
+@click.option('-o', '--output', type=OutputFormat(['wide']),
               help="Output format.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
-#@click.option('--filter', 'filter_val', multiple=True)
+@click.option('--filter', 'filter_val', multiple=True,
+              help="Filter tasks usage KEY=VALUE, KEY!=VALUE, KEY=~REGEX or KEY~REGEX. Exact filters on "
+                   "serviceName, family, containerInstance, startedBy, launchType and desiredStatus are "
+                   "sent to AWS, other keys are matched against task fields or JSONPath expressions.")
 @click.pass_context
-def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  # filter_val=None
+def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output, filter_val):
     """
     \b
     # Show all running tasks.
@@ -235,40 +330,61 @@ def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  #
     \b
     # Get all running task and create custom clumn: taks name and memory reservation.
     cmd::ecsctl get task --jsonpath "[*].containers[0].name" --jsonpath "[*].cpu" --jsonpath "[*].memory"
-    """
-    # TODO: ecsctl get po --filter "TASK_ID=~'.*'" --filter "STATUS=ACTIVE"
-    #  =   : Select labels that are exactly equal to the provided string.
-    #  !=  : Select labels that are not equal to the provided string.
-    #  =~  : Select labels that regex-match the provided string.
-    #  ~   : Select labels that do not regex-match the provided string.
-    #  eg:
-    #  environment=~"staging|testing|development"
-    #  job=~".*"
 
+    \b
+    # Show tasks from one service (filtered by AWS).
+    cmd::ecsctl get task --filter serviceName=my-app
+
+    \b
+    # Show tasks from one family which don't run on FARGATE.
+    cmd::ecsctl get task --filter family=my-app --filter "launchType!=FARGATE"
+
+    \b
+    # Show tasks which ID starts with 41ff.
+    cmd::ecsctl get task --filter "TASK_ID=~'41ff.*'"
+
+    \b
+    # Show tasks with custom columns.
+    cmd::ecsctl get task -o custom-columns=ID:.taskArn,CPU:.cpu,MEMORY:.memory
+    """
     headers, out, instances = [], [], {}
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    records = bw.get_tasks(cluster=cluster, status=status)
+    try:
+        pushed, local = filters.plan_task_filters(filters.parse_filters(filter_val), status)
+        task_filter = filters.TaskFilter(local)
+    except exceptions.FilterException as err:
+        return click.echo(click.style(str(err), fg='red'))
+    records = bw.iter_tasks(cluster=cluster, status=None, **pushed)
+    if task_filter:
+        records = (r for r in records if task_filter.match(r))
+    stream = not (sort_by or json_path or items)
+    if not stream:
+        records = list(records)
     if sort_by and records:
-        records.sort(key=lambda r: parse(sort_by).find(r)[0].value)
+        query.sort_records(records, sort_by)
+    if output and output != 'wide':
+        if items:
+            records = records[-items:]
+        return echo_custom_columns(records, output)
     if json_path:
-        for _jp in json_path:
-            h = None
-            jsonpath_expr = parse(_jp)
-            for x, match in enumerate(jsonpath_expr.find(records)):
-                try:
-                    out[x].append(match.value)
-                except IndexError:
-                    out.append([match.value])
-                h = str(match.path)
-            headers.append(h)
-        # if filter_val:
-        #     raise ValueError
+        columns = [query.Column(_jp) for _jp in json_path]
+        headers = [c.header for c in columns]
+        out = query.project(records, columns)
+    elif quiet and stream:
+        for r in records:
+            click.echo(display.simple_task(r['taskArn']))
+        return
     else:
         now = datetime.datetime.now(pytz.utc)
-        for inst in bw.get_container_instances(cluster=cluster):
-            instances[inst['containerInstanceArn']] = inst
+        if not quiet:
+            for inst in bw.get_container_instances(cluster=cluster):
+                instances[inst['containerInstanceArn']] = inst
+        if output == 'wide':
+            records = list(records)
+            task_definitions = bw.describe_task_definitions([r['taskDefinitionArn'] for r in records], cluster=cluster)
+            task_definition_logs = {arn: _task_definition_logs(td) for arn, td in task_definitions.items()}
         for x, r in enumerate(records):
             status = r['lastStatus']
             created_at = r['createdAt']
@@ -277,9 +393,10 @@ def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  #
             age = humanize.naturaltime(now - created_at)
             instance = None
             public_ip = None
-            if 'containerInstanceArn' in r:
-                instance = instances[r['containerInstanceArn']]['ec2_data']['PrivateIpAddress']
-                public_ip = instances[r['containerInstanceArn']]['ec2_data'].get('PublicIpAddress', '')
+            if 'containerInstanceArn' in r and not quiet:
+                ec2_data = instances.get(r['containerInstanceArn'], {}).get('ec2_data', {})
+                instance = ec2_data.get('PrivateIpAddress')
+                public_ip = ec2_data.get('PublicIpAddress', '')
             containers = ' | '.join([x['name'] for x in r['containers']])
             ports = []
             for c in r.get('containers', []):
@@ -290,31 +407,13 @@ def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  #
                         port.get('containerPort'),
                         port.get('protocol'))
                     ports.append(p)
-            if output:
-                info = bw.describe_task_definition(r['taskDefinitionArn'], cluster=cluster)
-                c, l = [], []
-
-                for td in info['containerDefinitions']:
-                    c.append(td['name'])
-                    log_config = td.get('logConfiguration', {})
-                    if log_config.get('logDriver', {}) == 'awslogs':
-                        options = log_config.get('options')
-                        if options.get('awslogs-group') and \
-                                options.get('awslogs-region') and \
-                                options.get('awslogs-stream-prefix'):
-                            l.append('awslogs')
-                        else:
-                            l.append('none')
-                    else:
-                        l.append('none')
-                logs, containers = ' | '.join(l), ' | '.join(c)
+            if output == 'wide':
+                logs, containers = task_definition_logs[r['taskDefinitionArn']]
 
             row = [task_id, status, containers, '\n'.join(ports), task_def, age, instance]
-            if output:
+            if output == 'wide':
                 row[-1] = public_ip
                 row.append(logs)
-            # if filter_val:
-            #     raise ValueError
             if quiet:
                 row = [row[0]]
             out.append(row)
@@ -325,7 +424,7 @@ def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  #
         if not quiet:
             headers = ['TASK ID', 'STATUS', 'CONTAINERS', 'PORTS', 'TASK DEFINITION', 'AGE', 'EC2 PRIVATE IP', 'LOGS']
 
-        if output:
+        if output == 'wide' and headers:
             headers[-2] = 'EC2 PUBLIC IP'
     output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
     click.echo(output)
@@ -336,8 +435,10 @@ def get_task(ctx, cluster, sort_by, status, items, quiet, json_path, output):  #
               help="Filter task definition family usage prefix name.")
 @click.option('--status', type=click.Choice(TASK_DEFINITION_STATUS), default='ACTIVE', show_default=True,
               help="Filter task definition family usage status.")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_task_definition_family(ctx, status, family_prefix):
+def get_task_definition_family(ctx, status, family_prefix, output):
     """
     \b
     # Show all active task definition family.
@@ -356,6 +457,9 @@ def get_task_definition_family(ctx, status, family_prefix):
         family_prefix=family_prefix,
         status=status,
     )
+    if output:
+        records = [dict(family=r[0], taskDefinitionArn=r[1], revisions=r[2], status=status) for r in records]
+        return echo_custom_columns(records, output)
     out = []
     for r in records:
         familly_name = r[0]
@@ -373,8 +477,10 @@ def get_task_definition_family(ctx, status, family_prefix):
               help="Filter task definition usage prefix name.")
 @click.option('--status', type=click.Choice(TASK_DEFINITION_STATUS), default='ACTIVE', show_default=True,
               help="Filter task definition usage status.")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_task_definition(ctx, status, family_prefix):
+def get_task_definition(ctx, status, family_prefix, output):
     """
     \b
     # Show all active task defunition.
@@ -393,6 +499,8 @@ def get_task_definition(ctx, status, family_prefix):
         family_prefix=family_prefix,
         status=status,
     )
+    if output:
+        return echo_custom_columns([dict(taskDefinitionArn=r) for r in records], output)
     for r in records:
         out = display.simple_task_definition(r)
         click.echo(out)
@@ -403,7 +511,7 @@ def get_task_definition(ctx, status, family_prefix):
               help="Filter task definition usage prefix name.")
 @click.option('--variables', is_flag=True, default=False,
               help="Show variables from one task definition family.")
-@click.option('-o', '--output', type=click.Choice(['wide']),
+@click.option('-o', '--output', type=OutputFormat(['wide']),
               help="Output format.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
@@ -431,6 +539,9 @@ def get_secret(ctx, family_prefix, variables, output, cluster):
     if not cluster:
         cluster = ctx.obj['cluster']
     records = bw.all_secret(cluster=cluster, family_prefix=family_prefix, variables=variables)
+    if output and output != 'wide':
+        keys = ['Name', 'Version', 'LastModifiedDate'] if variables else ['cluster', 'family', 'count']
+        return echo_custom_columns([dict(zip(keys, r)) for r in records], output)
     out = []
     for r in records:
         first_col = r[0]
@@ -461,8 +572,10 @@ def get_secret(ctx, family_prefix, variables, output, cluster):
 
 
 @get.command(name='service-discovery', short_help="List service discovery namespace from your account.")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_service_discovery(ctx):
+def get_service_discovery(ctx, output):
     """
     \b
     # Show all service-discovery
@@ -471,6 +584,8 @@ def get_service_discovery(ctx):
     now = datetime.datetime.now(pytz.utc)
     bw = ctx.obj['bw']
     records = bw.all_service_discovery()
+    if output:
+        return echo_custom_columns(records, output)
     out = []
     for r in records:
         out.append((r.get('Id'), r.get('Name'), r.get('Type'), humanize.naturaltime(now - r.get('CreateDate'))))
@@ -482,8 +597,10 @@ def get_service_discovery(ctx):
 @get.command(name='loadbalancer', short_help="List load balancer from your account.")
 @click.option('--arn', is_flag=True, default=False,
               help="Output format.")
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_load_balancer(ctx, arn):
+def get_load_balancer(ctx, arn, output):
     """
     \b
     # Show all load-balancer
@@ -496,6 +613,8 @@ def get_load_balancer(ctx, arn):
     now = datetime.datetime.now(pytz.utc)
     bw = ctx.obj['bw']
     records = bw.all_load_balancer()
+    if output:
+        return echo_custom_columns(records, output)
     out = []
     for r in records:
         if arn:
@@ -518,8 +637,10 @@ def get_load_balancer(ctx, arn):
 
 @get.command(name='hosted-zones', short_help="List hosted zones from your account.")
 @click.argument('hosted-zone', required=False)
+@click.option('-o', '--output', type=OutputFormat(),
+              help="Output format.")
 @click.pass_context
-def get_zone(ctx, hosted_zone):
+def get_zone(ctx, hosted_zone, output):
     """
     \b
     # Show all hosted-zones
@@ -530,6 +651,9 @@ def get_zone(ctx, hosted_zone):
     cmd::ecsctl get hosted-zones /hostedzone/00000000000000000000
     """
     bw = ctx.obj['bw']
+    if output:
+        records = bw.all_resource_record(hosted_zone) if hosted_zone else bw.all_hosted_zone()
+        return echo_custom_columns(records, output)
     if not hosted_zone:
         headers = ['ID', 'NAME', 'PRIVATE ZONE', 'RECORD COUNT']
         records = bw.all_hosted_zone()
@@ -1,13 +1,35 @@
-import time
+import re
 import datetime
+from functools import partial
 
 import click
 
+from .. import archive, exceptions, grep, logstream
 from ..colorize import HelpColorsGroup
 
 
-@click.group(cls=HelpColorsGroup, name='logs', short_help='Print the logs for a container usage CloudWatch.', invoke_without_command=True)
-@click.argument('task', required=True)
+class LogsGroup(HelpColorsGroup):
+    """`logs TASK [OPTIONS]` runs the group itself; `logs export ...` must not take `export` as the task."""
+
+    allow_interspersed_args = True
+
+    def parse_args(self, ctx, args):
+        if args and args[0] in self.commands:
+            super(LogsGroup, self).parse_args(ctx, [])
+            if hasattr(ctx, '_protected_args'):
+                ctx._protected_args, ctx.args = args[:1], args[1:]
+            else:
+                ctx.protected_args, ctx.args = args[:1], args[1:]
+            return ctx.args
+        return super(LogsGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=LogsGroup, name='logs', short_help='Print the logs for a container usage CloudWatch.', invoke_without_command=True)
+@click.argument('task', required=False)
+@click.option('--service',
+              help="Search the logs of every task of a service with CloudWatch Logs Insights.")
+@click.option('--family',
+              help="Search the logs of every task of a task definition family with CloudWatch Logs Insights.")
 @click.option('-f', '--follow', is_flag=True, default=False,
               help="Specify if the logs should be streamed.")
 @click.option('--container',
@@ -18,13 +40,23 @@ from ..colorize import HelpColorsGroup
               help="Select end time when you need show logs.")
 @click.option('--filter',
               help="Filter logs usage AWS filter and pattern syntax. You can find more details in "
-                   "https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/FilterAndPatternSyntax.html")
+                   "https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/FilterAndPatternSyntax.html. "
+                   "With --service or --family it is a regular expression.")
+@click.option('--limit', type=click.IntRange(1, logstream.INSIGHTS_MAX_LIMIT), default=logstream.INSIGHTS_LIMIT,
+              show_default=True, help="Maximum number of events returned for --service or --family.")
+@click.option('--grep', 'grep_pattern',
+              help="Show only events whose message matches this regular expression, matched locally.")
+@click.option('--json-where', multiple=True,
+              help="Show only JSON events matching KEY=VALUE, KEY!=VALUE, KEY=~REGEX or KEY~REGEX, where KEY is "
+                   "a JSONPath expression, e.g. `level=error`. Can be repeated.")
+@click.option('--archive', 'from_archive', is_flag=True, default=False,
+              help="Read logs saved by `ecsctl logs export` instead of CloudWatch. --filter is a regular expression.")
 @click.option('--byte-size', type=int, default=1024, show_default=True,
               help="Defind maximum size logs in bytes if you don't specify time.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
 @click.pass_context
-def logs(ctx, task, follow, *args, **kwargs):
+def logs(ctx, task, follow, service, family, limit, from_archive, *args, **kwargs):
     """
     \b
     # Show logs from one selected task
@@ -45,23 +77,221 @@ def logs(ctx, task, follow, *args, **kwargs):
     \b
     # Show logs from one selected task between selected time and selected container and filter response
     cmd::ecsctl logs 41ff5a8d-56ed-431f-8d2a-f056826b7cde -c gunicorn --start 2019-09-07T19:00:00 --end 2019-09-07T22:00:00 --filter "ERRORCODE: -1"
+
+    \b
+    # Search the last hour of logs of all tasks of a service
+    cmd::ecsctl logs --service my-service --filter "ERROR|Traceback"
+
+    \b
+    # Search the logs of one container of a task definition family between selected time
+    cmd::ecsctl logs --family my-app --container gunicorn --start 2019-09-07T19:00:00 --end 2019-09-07T22:00:00
+
+    \b
+    # Show only JSON logs of a task with level error whose message mentions a timeout
+    cmd::ecsctl logs 41ff5a8d-56ed-431f-8d2a-f056826b7cde --json-where level=error --grep "[Tt]imeout"
+    """
+    if ctx.invoked_subcommand:
+        return
+    cluster = kwargs.pop('cluster', None)
+
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    bw = ctx.obj['bw']
+
+    if len([x for x in (task, service, family) if x]) != 1:
+        click.echo(click.style('Select a task, `--service` or `--family`.', fg='red'))
+        return
+    try:
+        grep.Matcher(kwargs.get('grep_pattern'), kwargs.get('json_where'))
+    except exceptions.FilterException as err:
+        click.echo(click.style(str(err), fg='red'))
+        return
+    if from_archive:
+        if follow:
+            click.echo(click.style('`--follow` doesn\'t work with `--archive`.', fg='red'))
+            return
+        return read_archive(bw, cluster, task, service, family, **kwargs)
+    if service or family:
+        if follow:
+            click.echo(click.style('`--follow` works only with a task.', fg='red'))
+            return
+        return search_logs(bw, cluster, service, family, limit=limit, **kwargs)
+
+    if follow:
+        return follow_logs(bw, task, cluster, **kwargs)
+
+    resp, err = bw.logs(task, cluster, *args, **kwargs)
+    if err:
+        click.echo(click.style(resp, fg='red'))
+    elif resp:
+        click.echo(resp)
+
+
+def follow_logs(bw, task, cluster, container=None, start_time=None, filter=None, grep_pattern=None, json_where=(),
+                **kwargs):
+    try:
+        streams, info = logstream.task_log_streams(bw, task, cluster, container)
+    except Exception as err:
+        click.echo(click.style(str(err), fg='red'))
+        return
+    for item in info:
+        click.echo('[{}] {}'.format(*item))
+    if not streams:
+        click.echo('This task don\'t usage CloudWatch Logs.')
+        return
+
+    start_time = int(start_time.timestamp()) * 1000 if start_time else None
+    follower = logstream.LogFollower(bw.logs_client, streams, start_time=start_time, filter_pattern=filter)
+    # Every poll returns a handful of events, so match them in-process.
+    matcher = grep.Matcher(grep_pattern, json_where)
+    for event in follower.follow():
+        if matcher.match(event['message']):
+            click.echo(logstream.format_event(event))
+
+
+def resolve_prefixes(bw, cluster, service, family, container=None):
+    """`(log group, stream prefix)` of the containers of a service or family, or None after printing an error."""
+    try:
+        if service:
+            _service = bw.describe_service(service, cluster=cluster)
+            names = [d['taskDefinition'] for d in _service.get('deployments', [])] or [_service['taskDefinition']]
+            task_definitions = bw.describe_task_definitions(names, cluster).values()
+        else:
+            task_definitions = [bw.describe_task_definition(family, cluster=cluster)]
+        prefixes, info = [], []
+        for task_definition in task_definitions:
+            _prefixes, _info = logstream.container_log_prefixes(task_definition, container)
+            prefixes += [(group, prefix) for _, group, prefix in _prefixes if (group, prefix) not in prefixes]
+            info += [item for item in _info if item not in info]
+    except Exception as err:
+        click.echo(click.style(str(err), fg='red'))
+        return None
+    for item in info:
+        click.echo('[{}] {}'.format(*item))
+    if not prefixes:
+        click.echo('This service don\'t usage CloudWatch Logs.' if service else
+                   'This task definition don\'t usage CloudWatch Logs.')
+        return None
+    return prefixes
+
+
+def search_logs(bw, cluster, service, family, container=None, start_time=None, end_time=None, filter=None,
+                limit=logstream.INSIGHTS_LIMIT, grep_pattern=None, json_where=(), **kwargs):
+    prefixes = resolve_prefixes(bw, cluster, service, family, container)
+    if not prefixes:
+        return
+
+    end_time = end_time or datetime.datetime.now()
+    start_time = start_time or end_time - datetime.timedelta(hours=1)
+    query = logstream.LogsInsightsQuery(bw.logs_client, prefixes, start_time, end_time, pattern=filter, limit=limit)
+    try:
+        events = query.results()
+    except Exception as err:
+        click.echo(click.style(str(err), fg='red'))
+        return
+    for event in grep.filter_events(events, grep_pattern, json_where):
+        click.echo(logstream.format_event(event))
+
+
+def to_milliseconds(value):
+    return int(value.timestamp() * 1000) if value else None
+
+
+def read_archive(bw, cluster, task, service, family, container=None, start_time=None, end_time=None, filter=None,
+                 grep_pattern=None, json_where=(), **kwargs):
+    if task:
+        archives = [a for a in archive.archived_streams(suffix='/' + task)
+                    if not container or a.stream.split('/')[-2] == container]
+    else:
+        prefixes = resolve_prefixes(bw, cluster, service, family, container)
+        if not prefixes:
+            return
+        archives = [a for group, prefix in prefixes for a in archive.archived_streams(group=group, prefix=prefix)]
+    if not archives:
+        click.echo(click.style('Nothing is archived for this selection. Use `ecsctl logs export` first.', fg='red'))
+        return
+    try:
+        events = logstream.merge_events([a.read(to_milliseconds(start_time), to_milliseconds(end_time), filter)
+                                         for a in archives])
+        for event in grep.filter_events(events, grep_pattern, json_where):
+            click.echo(logstream.format_event(event))
+    except re.error as err:
+        click.echo(click.style('Invalid regular expression `{}`: {}'.format(filter, err), fg='red'))
+
+
+@logs.command(name='export', short_help="Download logs of a task, service or family to the local archive.")
+@click.argument('task', required=False)
+@click.option('--service',
+              help="Export the logs of every task of a service.")
+@click.option('--family',
+              help="Export the logs of every task of a task definition family.")
+@click.option('--container',
+              help="Select one container.")
+@click.option('--start-time', type=click.DateTime(formats=None),
+              help="Select start time of exported logs. Default one hour ago.")
+@click.option('--end-time', type=click.DateTime(formats=None),
+              help="Select end time of exported logs. Default everything up to now.")
+@click.option('-c', '--cluster',
+              help="Specify cluster to execute command. Default usage cluster from context.")
+@click.pass_context
+def logs_export(ctx, task, service, family, container, start_time, end_time, cluster):
     """
-    cluster, timestamp = kwargs.pop('cluster', None), None
+    \b
+    # Download the last hour of logs of a task to the local archive
+    cmd::ecsctl logs export 41ff5a8d-56ed-431f-8d2a-f056826b7cde
 
+    \b
+    # Download the logs of a service between selected time
+    cmd::ecsctl logs export --service my-service --start 2019-09-07T19:00:00 --end 2019-09-07T22:00:00
+
+    \b
+    # Search the archive, running it again only downloads new events
+    cmd::ecsctl logs --archive --service my-service --filter "ERROR|Traceback"
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    while True:
-        timestamp = datetime.datetime.now()
-        resp, err = bw.logs(task, cluster, *args, **kwargs)
 
-        if err:
-            click.echo(click.style(resp, fg='red'))
-        elif resp:
-            click.echo(resp)
+    if len([x for x in (task, service, family) if x]) != 1:
+        click.echo(click.style('Select a task, `--service` or `--family`.', fg='red'))
+        return
+
+    start = to_milliseconds(start_time or datetime.datetime.now() - datetime.timedelta(hours=1))
+    end = to_milliseconds(end_time)
+    try:
+        if task:
+            _streams, info = logstream.task_log_streams(bw, task, cluster, container)
+            for item in info:
+                click.echo('[{}] {}'.format(*item))
+            streams = [(stream.group, stream.name) for stream in _streams]
+        else:
+            prefixes = resolve_prefixes(bw, cluster, service, family, container)
+            if not prefixes:
+                return
+            streams = []
+            for group, prefix in prefixes:
+                for stream in bw.log_streams(group, prefix):
+                    # `lastEventTimestamp` is only updated eventually, `lastIngestionTime` is current.
+                    last_ingestion = stream.get('lastIngestionTime')
+                    if last_ingestion is not None and last_ingestion + logstream.INGESTION_MARGIN < start:
+                        continue
+                    if end is not None and stream.get('creationTime', 0) >= end:
+                        continue
+                    streams.append((group, stream['logStreamName']))
 
-        if not follow or err:
-            break
+        def export(stream):
+            group, name = stream
+            try:
+                return archive.export_stream(partial(bw.log_events, group, name),
+                                             archive.StreamArchive(group, name), start, end)
+            except Exception as err:
+                # A container which never wrote a log line has no stream yet.
+                if not logstream.is_missing_stream(err):
+                    raise
+                return None
 
-        kwargs['start_time'] = timestamp
-        time.sleep(1)
+        counts = [count for count in bw.fan_out(export, streams) if count is not None]
+    except Exception as err:
+        click.echo(click.style(str(err), fg='red'))
+        return
+    click.echo('Archived {} new events from {} streams in {}.'.format(sum(counts), len(counts), archive.ARCHIVE_DIR))
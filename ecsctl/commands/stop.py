@@ -1,7 +1,7 @@
 import click
 
 from ..alias import AliasedGroup
-from .. import wrapboto, display
+from .. import display
 
 
 @click.group(cls=AliasedGroup, short_help='Stop service.')
@@ -1,11 +1,57 @@
+import time
 import pytz
 import click
 import datetime
 import tabulate
 
+from .. import metrics
 from ..alias import AliasedGroup
 
 
+def time_window(start_time, end_time, default):
+    """`(start_time, end_time)` as aware datetimes; naive values are local time."""
+    end_time = end_time.astimezone() if end_time else datetime.datetime.now(pytz.utc)
+    start_time = start_time.astimezone() if start_time else end_time - default
+    return start_time, end_time
+
+
+def stat_headers(columns, stats):
+    return ['{}({})'.format(column, stat) for column in columns for stat in stats]
+
+
+def show_usage(bw, fetch, headers, start_time, end_time, default, watch=None):
+    """Print `fetch(start_time, end_time, series)` as a table.
+
+    With `watch` the window slides with the current time and the table is
+    redrawn every `watch` seconds; the series are kept in a
+    `metrics.SeriesStore`, so each refresh only fetches the new datapoints.
+    """
+    if watch and end_time:
+        return click.echo(click.style('`--watch` can\'t be used with `--end-time`.', fg='red'))
+    start_time, end_time = time_window(start_time, end_time, default)
+    if start_time > end_time:
+        return click.echo(click.style('Start date parameter must be set before end date.', fg='red'))
+
+    if not watch:
+        out, err = fetch(start_time, end_time, None)
+        if err:
+            return click.echo(click.style(out, fg='red'))
+        return click.echo(tabulate.tabulate(out, headers=headers, tablefmt='plain'))
+
+    window, series = end_time - start_time, metrics.SeriesStore(bw.get_metric_data)
+    try:
+        while True:
+            end_time = datetime.datetime.now(pytz.utc)
+            out, err = fetch(end_time - window, end_time, series)
+            output = click.style(out, fg='red') if err else tabulate.tabulate(out, headers=headers, tablefmt='plain')
+            click.clear()
+            click.echo('Every {}s, last {}: {}\n'.format(watch, window, end_time.astimezone().strftime('%Y-%m-%d %H:%M:%S')))
+            click.echo(output)
+            time.sleep(watch)
+    except KeyboardInterrupt:
+        pass
+
+
 @click.group(cls=AliasedGroup, short_help='Display Resource (CPU/Memory) usage.')
 def top():
     pass
@@ -16,10 +62,14 @@ def top():
               help="Select start time when you need to check usage resources.")
 @click.option('--end-time', type=click.DateTime(formats=None),
               help="Select end time when you need to check usage resources.")
+@click.option('--stat', 'stats', type=click.Choice(metrics.STATISTICS), multiple=True,
+              help="Statistic of every metric over the time window to show (default: all). Can be repeated.")
+@click.option('-w', '--watch', type=click.IntRange(1), metavar='INTERVAL',
+              help="Refresh every INTERVAL seconds, fetching only the datapoints since the last refresh.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
 @click.pass_context
-def top_cluster(ctx, cluster, start_time=None, end_time=None):
+def top_cluster(ctx, cluster, stats, watch, start_time=None, end_time=None):
     """
     \b
     # Show avaraged usage resource from last 30m
@@ -35,21 +85,12 @@ def top_cluster(ctx, cluster, start_time=None, end_time=None):
     """
     if not cluster:
         cluster = ctx.obj['cluster']
-    if not end_time:
-        end_time = datetime.datetime.now(pytz.utc)
-    if not start_time:
-        start_time = end_time - datetime.timedelta(minutes=30)
-    if start_time > end_time:
-        return click.echo(click.style('Start date parameter must be set before end date.', fg='red'))
+    stats = [stat for stat in metrics.STATISTICS if stat in stats] or metrics.STATISTICS
+    headers = ['CLUSTER'] + stat_headers(['CPU RESERVED/USED', 'MEMORY RESERVED/USED'], stats)
 
     bw = ctx.obj['bw']
-    out, err = bw.get_cluster_metric_data(cluster, start_time, end_time)
-    if err:
-        return click.echo(click.style(out, fg='red'))
-
-    headers = ['CLUSTER', 'CPU(percent)', 'MEMORY(percent)']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    return click.echo(output)
+    fetch = lambda start, end, series: bw.get_cluster_metric_data(cluster, start, end, stats, series=series)
+    return show_usage(bw, fetch, headers, start_time, end_time, datetime.timedelta(minutes=30), watch)
 
 
 @top.command(name='service')
@@ -57,10 +98,18 @@ def top_cluster(ctx, cluster, start_time=None, end_time=None):
               help="Select start time when you need to check usage resources.")
 @click.option('--end-time', type=click.DateTime(formats=None),
               help="Select end time when you need to check usage resources.")
+@click.option('--stat', 'stats', type=click.Choice(metrics.STATISTICS), multiple=True,
+              help="Statistic of every metric over the time window to show (default: all). Can be repeated.")
+@click.option('-w', '--watch', type=click.IntRange(1), metavar='INTERVAL',
+              help="Refresh every INTERVAL seconds, fetching only the datapoints since the last refresh.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
+@click.option('--sort', type=click.Choice(['cpu', 'memory']),
+              help="Show only the services with the highest average usage, ranked by CloudWatch Metrics Insights.")
+@click.option('--limit', type=click.IntRange(1, 500), default=20, show_default=True,
+              help="Number of services shown with --sort.")
 @click.pass_context
-def top_service(ctx, cluster, start_time=None, end_time=None):
+def top_service(ctx, cluster, stats, watch, sort, limit, start_time=None, end_time=None):
     """
     \b
     # Show avaraged usage resource from last 30m
@@ -73,24 +122,31 @@ def top_service(ctx, cluster, start_time=None, end_time=None):
     \b
     # Show avaraged usage resource from last 1d
     cmd::ecsctl top service --start-time 2019-09-20T12:35:00 --end-time 2019-09-19T12:35:00
+
+    \b
+    # Show only the 95th percentile and the maximum of the usage from last 1d
+    cmd::ecsctl top service --start-time 2019-09-19T12:35:00 --stat p95 --stat max
+
+    \b
+    # Show usage resource from last 30m and refresh it every 30 seconds
+    cmd::ecsctl top service --watch 30
+
+    \b
+    # Show 20 services with the highest CPU usage from last 30m
+    cmd::ecsctl top service --sort cpu --limit 20
     """
     if not cluster:
         cluster = ctx.obj['cluster']
-    if not end_time:
-        end_time = datetime.datetime.now(pytz.utc)
-    if not start_time:
-        start_time = end_time - datetime.timedelta(minutes=30)
-    if start_time > end_time:
-        return click.echo(click.style('Start date parameter must be set before end date.', fg='red'))
+    stats = [stat for stat in metrics.STATISTICS if stat in stats] or metrics.STATISTICS
+    headers = ['SERVICE'] + stat_headers(['CPU', 'MEMORY'], stats)
 
     bw = ctx.obj['bw']
-    out, err = bw.get_service_metric_data(cluster, start_time, end_time)
-    if err:
-        return click.echo(click.style(out, fg='red'))
-
-    headers = ['SERVICE', 'CPU(percent)', 'MEMORY(percent)']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    return click.echo(output)
+    if sort:
+        fetch = lambda start, end, series: bw.get_top_service_metric_data(
+            cluster, start, end, sort, limit, stats, series=series)
+    else:
+        fetch = lambda start, end, series: bw.get_service_metric_data(cluster, start, end, stats, series=series)
+    return show_usage(bw, fetch, headers, start_time, end_time, datetime.timedelta(minutes=30), watch)
 
 
 @top.command(name='container-instance')
@@ -98,10 +154,14 @@ def top_service(ctx, cluster, start_time=None, end_time=None):
               help="Select start time when you need to check usage resources.")
 @click.option('--end-time', type=click.DateTime(formats=None),
               help="Select end time when you need to check usage resources.")
+@click.option('--stat', 'stats', type=click.Choice(metrics.STATISTICS), multiple=True,
+              help="Statistic of every metric over the time window to show (default: all). Can be repeated.")
+@click.option('-w', '--watch', type=click.IntRange(1), metavar='INTERVAL',
+              help="Refresh every INTERVAL seconds, fetching only the datapoints since the last refresh.")
 @click.option('-c', '--cluster',
               help="Specify cluster to execute command. Default usage cluster from context.")
 @click.pass_context
-def top_container_instance(ctx, cluster, start_time=None, end_time=None):
+def top_container_instance(ctx, cluster, stats, watch, start_time=None, end_time=None):
     """
     \b
     # Show avaraged usage resource from last 30m
@@ -117,18 +177,52 @@ def top_container_instance(ctx, cluster, start_time=None, end_time=None):
     """
     if not cluster:
         cluster = ctx.obj['cluster']
-    if not end_time:
-        end_time = datetime.datetime.now(pytz.utc)
-    if not start_time:
-        start_time = end_time - datetime.timedelta(minutes=5)
-    if start_time > end_time:
-        return click.echo(click.style('Start date parameter must be set before end date.', fg='red'))
+    stats = [stat for stat in metrics.STATISTICS if stat in stats] or metrics.STATISTICS
+    headers = ['INSTANCE ID', 'EC2 INSTANCE ID'] + stat_headers(['CPU', 'MEMORY', 'DISK', 'SWAP'], stats)
 
     bw = ctx.obj['bw']
-    out, err = bw.get_container_instance_metric_data(cluster, start_time, end_time)
-    if err:
-        return click.echo(click.style(out, fg='red'))
+    fetch = lambda start, end, series: bw.get_container_instance_metric_data(cluster, start, end, stats, series=series)
+    return show_usage(bw, fetch, headers, start_time, end_time, datetime.timedelta(minutes=5), watch)
+
+
+@top.command(name='task')
+@click.option('--service', help="Show only tasks of this service.")
+@click.option('--family', help="Show only tasks of this task definition family.")
+@click.option('--container', 'containers', is_flag=True, help="Show a row for every container of the tasks.")
+@click.option('--start-time', type=click.DateTime(formats=None),
+              help="Select start time when you need to check usage resources.")
+@click.option('--end-time', type=click.DateTime(formats=None),
+              help="Select end time when you need to check usage resources.")
+@click.option('--stat', 'stats', type=click.Choice(metrics.STATISTICS), multiple=True,
+              help="Statistic of every metric over the time window to show (default: all). Can be repeated.")
+@click.option('-w', '--watch', type=click.IntRange(1), metavar='INTERVAL',
+              help="Refresh every INTERVAL seconds, fetching only the datapoints since the last refresh.")
+@click.option('-c', '--cluster',
+              help="Specify cluster to execute command. Default usage cluster from context.")
+@click.pass_context
+def top_task(ctx, cluster, service, family, containers, stats, watch, start_time=None, end_time=None):
+    """
+    Usage is shown in percent of the task (or container) reservation and
+    needs Container Insights with enhanced observability.
+
+    \b
+    # Show usage resource of all running tasks from last 30m
+    cmd::ecsctl top task
 
-    headers = ['INSTANCE ID', 'EC2 INSTANCE ID', 'CPU(percent)', 'MEMORY(percent)', 'DISK(percent)', 'SWAP(percent)']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    return click.echo(output)
+    \b
+    # Show usage resource of every container of the tasks of one service
+    cmd::ecsctl top task --service my-service --container
+
+    \b
+    # Show the maximum usage resource of the tasks of one family from last 1h (Current we have 20 September 2019 12:35)
+    cmd::ecsctl top task --family my-app --start-time 2019-09-20T11:35:00 --stat max
+    """
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    stats = [stat for stat in metrics.STATISTICS if stat in stats] or metrics.STATISTICS
+    headers = ['TASK', 'GROUP'] + (['CONTAINER'] if containers else []) + stat_headers(['CPU', 'MEMORY'], stats)
+
+    bw = ctx.obj['bw']
+    fetch = lambda start, end, series: bw.get_task_metric_data(
+        cluster, start, end, stats, service=service, family=family, containers=containers, series=series)
+    return show_usage(bw, fetch, headers, start_time, end_time, datetime.timedelta(minutes=30), watch)
@@ -1,5 +1,6 @@
 import click
 from ..alias import AliasedGroup
+from ..exceptions import BotoWrapperException
 
 
 def get_value(found_elements, kind):
@@ -44,7 +45,11 @@ def update_task_definitions(ctx, task_definition_family, image_tag, cluster):
                                    'You used `--image-tag {}`'.format(image), fg="red"))
             return
         data[container] = tag
-    resp = bw.update_task_definition(task_definition_family, cluster, images_tags=data)
+    try:
+        resp = bw.update_task_definition(task_definition_family, cluster, images_tags=data)
+    except BotoWrapperException as err:
+        click.echo(click.style(str(err), fg="red"))
+        return
     click.echo(click.style(resp['taskDefinition']['taskDefinitionArn'], fg="green"))
 
 
@@ -1,15 +1,27 @@
 import os
+import json
+import tempfile
 
 from configparser import RawConfigParser
+from contextlib import contextmanager
 from os.path import expanduser
 
-__all__ = ['read_config', 'update_config', 'default_config']
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['read_config', 'update_config', 'default_config', 'read_credentials', 'write_credentials',
+           'credentials_lock']
 
 
 SECTION = 'ecsctl'
 CONTEXT = 'context'
 APP_DIR = os.path.join(expanduser("~"), '.ecsctl')
 CONFIG_FILE = os.path.join(APP_DIR, 'config')
+CREDENTIALS_FILE = os.path.join(APP_DIR, 'credentials')
+CREDENTIALS_LOCK = os.path.join(APP_DIR, 'credentials.lock')
+TEMPORARY_KEYS = ['_aws_expiration', '_aws_session_token', '_aws_access_key_id', '_aws_secret_access_key']
 
 default_config = {
     'cluster': os.environ.get('AWS_ECS_CLUSTER_NAME', 'default'),
@@ -24,6 +36,7 @@ default_config = {
     'ssh_bastion_user': os.environ.get('AWS_ECS_SSH_BASTION_USER', 'ec2-user'),
     'ssh_bastion_ip': os.environ.get('AWS_ECS_SSH_BASTION_IP', None),
     'ssh_key_location': os.environ.get('AWS_ECS_SSH_KEY_LOCATION', "~/.ssh/id_rsa"),
+    'max_workers': os.environ.get('AWS_ECS_MAX_WORKERS', 10),
     '_aws_expiration': None,
     '_aws_session_token': None,
     '_aws_access_key_id': None,
@@ -31,11 +44,77 @@ default_config = {
 }
 
 
+_parsed = {'stamp': None, 'parser': None}
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
 def get_config_parser():
-    parser = RawConfigParser()
-    if os.path.isfile(CONFIG_FILE):
-        parser.read([CONFIG_FILE])
-    return parser
+    """Parse CONFIG_FILE once and reuse it for as long as the file doesn't change."""
+    stamp = _stamp(CONFIG_FILE)
+    if _parsed['parser'] is None or _parsed['stamp'] != stamp:
+        parser = RawConfigParser()
+        if stamp:
+            parser.read([CONFIG_FILE])
+        _parsed.update(stamp=stamp, parser=parser)
+    return _parsed['parser']
+
+
+def _atomic_write(path, write):
+    os.makedirs(APP_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=APP_DIR, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_config(parser):
+    _atomic_write(CONFIG_FILE, parser.write)
+    _parsed.update(stamp=_stamp(CONFIG_FILE), parser=parser)
+
+
+@contextmanager
+def credentials_lock():
+    """Serialize credential refreshes between ecsctl processes."""
+    os.makedirs(APP_DIR, exist_ok=True)
+    with open(CREDENTIALS_LOCK, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_all_credentials():
+    try:
+        with open(CREDENTIALS_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_credentials(context):
+    """Temporary `_aws_*` credentials cached for `context`."""
+    return _read_all_credentials().get(context, {})
+
+
+def write_credentials(context, data):
+    """Store temporary credentials for `context`. Call it holding `credentials_lock()`."""
+    credentials = _read_all_credentials()
+    credentials[context] = data
+    _atomic_write(CREDENTIALS_FILE, lambda f: json.dump(credentials, f))
 
 
 def get_clusters():
@@ -63,6 +142,7 @@ def read_config(show_file_path=None, show_all=None, show_temporary=None):
         print(CONFIG_FILE)
     if context:
         pars = parser.items(context)
+    credentials = _read_all_credentials() if show_temporary else {}
     if show_all:
         for section in parser.sections():
             parse = {}
@@ -71,6 +151,7 @@ def read_config(show_file_path=None, show_all=None, show_temporary=None):
                     parse[key] = value
                 if show_temporary and key.startswith('_aws'):
                     parse[key] = value
+            parse.update(credentials.get(section, {}))
             rv[section] = parse
     else:
         for key, value in pars:
@@ -78,6 +159,7 @@ def read_config(show_file_path=None, show_all=None, show_temporary=None):
                 rv[key] = value
             if show_temporary and key.startswith('_aws'):
                 rv[key] = value
+        rv.update(credentials.get(context, {}))
     return rv
 
 
@@ -93,10 +175,7 @@ def update_config(name, cluster_name, **kwargs):
     for key, value in kwargs.items():
         if value:
             parser.set(name, key, value)
-    if not os.path.exists(APP_DIR):
-        os.mkdir(APP_DIR)
-    with open(CONFIG_FILE, 'w') as f:
-        parser.write(f)
+    write_config(parser)
     return 'Cluster "{}" was configured.'.format(cluster_name)
 
 
@@ -105,8 +184,5 @@ def update_context(cluster_name, **kwargs):
     if not parser.has_section(SECTION):
         parser.add_section(SECTION)
     parser.set(SECTION, CONTEXT, cluster_name)
-    if not os.path.exists(APP_DIR):
-        os.mkdir(APP_DIR)
-    with open(CONFIG_FILE, 'w') as f:
-        parser.write(f)
+    write_config(parser)
     return 'Active cluster is "{}".'.format(cluster_name)
@@ -0,0 +1,242 @@
+import io
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import threading
+import traceback
+import socketserver
+
+from .config import APP_DIR
+
+__all__ = ['SOCKET_PATH', 'Daemon', 'forward', 'request']
+
+
+SOCKET_PATH = os.path.join(APP_DIR, 'daemon.sock')
+
+# Only read-only, non-interactive commands are sent to the daemon.
+FORWARDED_COMMANDS = ['get', 'describe']
+
+FRAME_HEADER = struct.Struct('!cI')
+STDOUT, STDERR, EXIT, FALLBACK, REPLY = b'o', b'e', b'x', b'f', b'r'
+
+
+def environment():
+    """Variables which change what a command does; the daemon only serves clients with the same ones."""
+    return {k: v for k, v in os.environ.items() if k.startswith('AWS_')}
+
+
+def command_name(argv):
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg
+
+
+def write_frame(wfile, kind, payload=b''):
+    wfile.write(FRAME_HEADER.pack(kind, len(payload)) + payload)
+    wfile.flush()
+
+
+def read_frames(rfile):
+    while True:
+        header = rfile.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        kind, size = FRAME_HEADER.unpack(header)
+        yield kind, rfile.read(size)
+
+
+def connect(path=SOCKET_PATH):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(op, path=SOCKET_PATH, **payload):
+    """Send a control request (`ping`, `stop`) and return the daemon's reply."""
+    with connect(path) as sock:
+        sock.sendall(json.dumps(dict(payload, op=op)).encode('utf-8') + b'\n')
+        for kind, data in read_frames(sock.makefile('rb')):
+            if kind == REPLY:
+                return json.loads(data.decode('utf-8'))
+
+
+def forward(argv, path=SOCKET_PATH):
+    """Run `argv` in a running daemon and stream its output to this process.
+
+    Returns the exit code, or None when the command should run in-process:
+    no daemon is listening, the command is not forwarded, `ECSCTL_NO_DAEMON`
+    is set or the daemon runs with different `AWS_*` variables.
+    """
+    if os.environ.get('ECSCTL_NO_DAEMON') or command_name(argv) not in FORWARDED_COMMANDS:
+        return None
+    if not os.path.exists(path):
+        return None
+    try:
+        sock = connect(path)
+    except OSError:
+        return None
+    message = {'op': 'run', 'argv': argv, 'env': environment(), 'color': sys.stdout.isatty()}
+    with sock:
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        streams = {STDOUT: sys.stdout, STDERR: sys.stderr}
+        for kind, data in read_frames(sock.makefile('rb')):
+            if kind in streams:
+                streams[kind].buffer.write(data)
+                streams[kind].flush()
+            elif kind == EXIT:
+                return struct.unpack('!i', data)[0]
+            elif kind == FALLBACK:
+                return None
+    # The daemon went away mid-command.
+    return 1
+
+
+class FrameWriter(io.RawIOBase):
+
+    def __init__(self, wfile, kind):
+        self.wfile = wfile
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        write_frame(self.wfile, self.kind, bytes(b))
+        return len(b)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        op = message.get('op')
+        try:
+            if op == 'run':
+                self.run(message)
+            elif op == 'ping':
+                self.reply(self.server.status())
+            elif op == 'stop':
+                self.reply({'stopped': True})
+                threading.Thread(target=self.server.shutdown).start()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def reply(self, data):
+        write_frame(self.wfile, REPLY, json.dumps(data).encode('utf-8'))
+
+    def run(self, message):
+        if message.get('env') != self.server.environment or self.server.needs_prompt():
+            write_frame(self.wfile, FALLBACK)
+            return
+        stdout, stderr = [io.TextIOWrapper(io.BufferedWriter(FrameWriter(self.wfile, kind)), encoding='utf-8',
+                                           errors='replace', line_buffering=True)
+                          for kind in (STDOUT, STDERR)]
+        code = self.server.execute(message['argv'], stdout, stderr, bool(message.get('color')))
+        for stream in (stdout, stderr):
+            try:
+                stream.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        write_frame(self.wfile, EXIT, struct.pack('!i', code))
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """Serves CLI invocations from one warm process.
+
+    Requests are handled one at a time because commands write to
+    `sys.stdout`; each `BotoWrapper` (and with it the boto3 session, its
+    clients, connection pools and caches) is kept between commands, one per
+    config context, and replaced when the context's settings change.
+    """
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.environment = environment()
+        self.started = time.time()
+        self.served = 0
+        self.wrappers = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.remove_stale_socket()
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            connect(self.path).close()
+        except OSError:
+            os.remove(self.path)
+        else:
+            raise OSError('Another daemon is already listening on {}.'.format(self.path))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def status(self):
+        return {'pid': os.getpid(), 'uptime': int(time.time() - self.started), 'served': self.served,
+                'sessions': len(self.wrappers)}
+
+    def needs_prompt(self):
+        """True when the current context would ask for an MFA code, which the daemon has no terminal for.
+
+        The client then runs the command in-process, where the user can type
+        it; the credentials it gets are written to `config.CREDENTIALS_FILE`
+        and picked up by the daemon's wrapper on its next refresh.
+        """
+        from .config import read_config
+        from .wrapboto import temporary_credentials
+        settings = read_config(show_temporary=True)
+        return bool(settings.get('aws_mfa_serial')) and temporary_credentials(settings) is None
+
+    def boto_wrapper(self, **kwargs):
+        from .cli import LazyBotoWrapper
+        from .config import get_default_context
+        # Temporary `_aws_*` credentials are left out: they rotate, and the wrapper's
+        # refreshable credentials pick up new ones from the credentials file.
+        settings = json.dumps({k: v for k, v in kwargs.items() if not k.startswith('_aws')},
+                              sort_keys=True, default=str)
+        context = get_default_context()
+        cached = self.wrappers.get(context)
+        if cached is None or cached[0] != settings:
+            self.wrappers[context] = settings, LazyBotoWrapper(**kwargs)
+        return self.wrappers[context][1]
+
+    def execute(self, argv, stdout, stderr, color):
+        from .cli import cli
+        from .config import default_config
+        self.served += 1
+        obj = dict(default_config, boto_wrapper=self.boto_wrapper)
+        streams = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin, sys.stdout, sys.stderr = io.StringIO(), stdout, stderr
+        try:
+            cli.main(args=argv, prog_name='ecsctl', obj=obj, color=color)
+        except SystemExit as err:
+            if err.code is None or isinstance(err.code, int):
+                return err.code or 0
+            print(err.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = streams
+        return 0
+
@@ -9,3 +9,11 @@ class ObjectTypeException(EcsctlException):
 
 class BotoWrapperException(EcsctlException):
     pass
+
+
+class FilterException(EcsctlException):
+    pass
+
+
+class QueryException(EcsctlException):
+    pass
@@ -0,0 +1,122 @@
+import re
+from collections import namedtuple
+
+from . import exceptions, query
+
+__all__ = ['parse_filters', 'plan_task_filters', 'RecordFilter', 'TaskFilter']
+
+
+# `!=` and `=~` must be tried before `=`, `!~` before `~`.
+FILTER_RE = re.compile(r'^\s*([^=!~\s]+)\s*(!=|=~|!~|=|~)\s*(.*?)\s*$')
+
+# Fields which `list_tasks` can filter server-side.
+TASK_PUSHDOWN = ['serviceName', 'family', 'containerInstance', 'startedBy', 'launchType', 'desiredStatus']
+
+TASK_FIELDS = {
+    'serviceName': lambda t: t.get('group', '').partition('service:')[2],
+    'family': lambda t: t['taskDefinitionArn'].split('/')[-1].rsplit(':', 1)[0],
+    'containerInstance': lambda t: t.get('containerInstanceArn', '').split('/')[-1],
+    'startedBy': lambda t: t.get('startedBy'),
+    'launchType': lambda t: t.get('launchType'),
+    'desiredStatus': lambda t: t.get('desiredStatus'),
+    'TASK_ID': lambda t: t['taskArn'].split('/')[-1],
+    'STATUS': lambda t: t.get('lastStatus'),
+    'TASK_DEFINITION': lambda t: t['taskDefinitionArn'].split('/')[-1],
+    'CONTAINERS': lambda t: [c.get('name') for c in t.get('containers', [])],
+}
+
+
+class Selector(namedtuple('Selector', ['key', 'op', 'value'])):
+    """One `KEY<op>VALUE` condition.
+
+    =   : value is exactly equal to the provided string.
+    !=  : value is not equal to the provided string.
+    =~  : value regex-matches the provided string.
+    ~   : value does not regex-match the provided string (also `!~`).
+    """
+
+    @property
+    def negative(self):
+        return self.op in ('!=', '~', '!~')
+
+    def compile(self):
+        if self.op in ('=~', '~', '!~'):
+            try:
+                pattern = re.compile(self.value)
+            except re.error as err:
+                raise exceptions.FilterException('Invalid regular expression in `{}`: {}'.format(self.value, err))
+            return lambda v: pattern.fullmatch(str(v)) is not None
+        return lambda v: str(v) == self.value
+
+
+def parse_filters(expressions):
+    selectors = []
+    for expression in expressions:
+        match = FILTER_RE.match(expression)
+        if not match:
+            raise exceptions.FilterException(
+                'Invalid filter `{}`. Use KEY=VALUE, KEY!=VALUE, KEY=~REGEX or KEY~REGEX.'.format(expression))
+        key, op, value = match.groups()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+            value = value[1:-1]
+        selectors.append(Selector(key, op, value))
+    return selectors
+
+
+def plan_task_filters(selectors, status='RUNNING'):
+    """Split selectors into `list_tasks` parameters and selectors evaluated after describe.
+
+    Only exact matches on `TASK_PUSHDOWN` fields can be sent to the API, and each
+    field only once. `startedBy` must be the only `list_tasks` filter, so it is
+    pushed alone when nothing else (except the default RUNNING status) is.
+    """
+    pushed, local = {}, []
+    for selector in selectors:
+        if selector.op == '=' and selector.key in TASK_PUSHDOWN and selector.key not in pushed:
+            pushed[selector.key] = selector.value
+        else:
+            local.append(selector)
+    pushed.setdefault('desiredStatus', status)
+
+    if 'startedBy' in pushed:
+        others = [k for k in pushed if k not in ('startedBy', 'desiredStatus')]
+        if others or pushed['desiredStatus'] != 'RUNNING':
+            local.append(Selector('startedBy', '=', pushed.pop('startedBy')))
+        else:
+            del pushed['desiredStatus']
+    return pushed, local
+
+
+class RecordFilter:
+    """Match records against selectors. Keys in `fields` use their getter, other keys are JSONPath expressions."""
+
+    fields = {}
+
+    def __init__(self, selectors):
+        self.selectors = selectors
+        self._checks = [(self._getter(s.key), s.compile(), s.negative) for s in selectors]
+
+    def __bool__(self):
+        return bool(self._checks)
+
+    def _getter(self, key):
+        if key in self.fields:
+            return self.fields[key]
+        try:
+            expression = query.compile_path(key)
+        except exceptions.QueryException:
+            raise exceptions.FilterException('`{}` is not a known field or a JSONPath expression.'.format(key))
+        return lambda t: [m.value for m in expression.find(t)]
+
+    def match(self, record):
+        for getter, check, negative in self._checks:
+            values = getter(record)
+            if not isinstance(values, list):
+                values = [] if values is None else [values]
+            if any(check(v) for v in values) == negative:
+                return False
+        return True
+
+
+class TaskFilter(RecordFilter):
+    fields = TASK_FIELDS
@@ -0,0 +1,98 @@
+import os
+import re
+import json
+import multiprocessing
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+
+from . import exceptions, filters
+
+__all__ = ['Matcher', 'filter_events']
+
+
+# Events sent to a worker at once; windows smaller than one batch are matched in-process.
+BATCH_SIZE = 5000
+
+
+class Matcher:
+    """`--grep` and `--json-where` for one log message.
+
+    `pattern` is searched in the raw message. `where` are `KEY=VALUE` style
+    selectors (see `filters.parse_filters`) with JSONPath keys, matched
+    against messages which are JSON objects; other messages never match.
+    """
+
+    def __init__(self, pattern=None, where=()):
+        try:
+            self.regex = re.compile(pattern) if pattern else None
+        except re.error as err:
+            raise exceptions.FilterException('Invalid regular expression `{}`: {}'.format(pattern, err))
+        self.where = filters.RecordFilter(filters.parse_filters(where))
+
+    def __bool__(self):
+        return bool(self.regex or self.where)
+
+    def match(self, message):
+        if self.regex and not self.regex.search(message):
+            return False
+        if self.where:
+            try:
+                record = json.loads(message)
+            except ValueError:
+                return False
+            if not isinstance(record, (dict, list)) or not self.where.match(record):
+                return False
+        return True
+
+
+_matcher = None
+
+
+def _start_worker(pattern, where):
+    global _matcher
+    _matcher = Matcher(pattern, where)
+
+
+def _match_batch(messages):
+    return [i for i, message in enumerate(messages) if _matcher.match(message)]
+
+
+def filter_events(events, pattern=None, where=(), workers=None, batch_size=BATCH_SIZE):
+    """Yield the events whose `message` matches, in their original order.
+
+    Batches of raw messages are matched in a process pool, with at most two
+    batches per worker in flight so a long window is never held in memory.
+    """
+    matcher = Matcher(pattern, where)
+    if not matcher:
+        yield from events
+        return
+
+    events = iter(events)
+    first = list(islice(events, batch_size))
+    workers = workers or os.cpu_count() or 1
+    if len(first) < batch_size or workers < 2:
+        for event in chain(first, events):
+            if matcher.match(event['message']):
+                yield event
+        return
+
+    # Fetching threads may be running, so don't fork.
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_start_worker, initargs=(pattern, list(where)))
+    pending = deque()
+    try:
+        for batch in chain([first], iter(lambda: list(islice(events, batch_size)), [])):
+            pending.append((batch, pool.submit(_match_batch, [event['message'] for event in batch])))
+            if len(pending) >= workers * 2:
+                batch, future = pending.popleft()
+                yield from (batch[i] for i in future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from (batch[i] for i in future.result())
+    finally:
+        # Batches not started yet are dropped when the reader stops early.
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
@@ -0,0 +1,93 @@
+import os
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+import botocore
+import botocore.session
+from botocore.loaders import Loader, create_loader
+
+from .cache import CACHE_DIR
+
+__all__ = ['CachedLoader', 'create_session']
+
+
+MODELS_DIR = os.path.join(CACHE_DIR, 'botocore-models')
+
+
+class CachedLoader(Loader):
+    """botocore loader which keeps parsed models as pickles next to the other caches.
+
+    Decompressing and parsing the JSON models (EC2 alone is several MB) is
+    most of the cost of creating a client; unpickling the same data is a few
+    times faster. Entries live under a directory named after the botocore
+    version, so upgrading botocore starts a new cache and removes the old one.
+    """
+
+    def __init__(self, directory=MODELS_DIR, **kwargs):
+        super(CachedLoader, self).__init__(**kwargs)
+        self.root = directory
+        self.directory = os.path.join(directory, botocore.__version__)
+
+    def _path(self, name):
+        return os.path.join(self.directory, hashlib.sha256(name.encode('utf-8')).hexdigest())
+
+    def _cached(self, name, load):
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            pass
+        data = load()
+        self._store(path, data)
+        return data
+
+    def _store(self, path, data):
+        try:
+            if not os.path.isdir(self.directory):
+                self._remove_other_versions()
+                os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _remove_other_versions(self):
+        try:
+            versions = os.listdir(self.root)
+        except OSError:
+            return
+        for version in versions:
+            if version != botocore.__version__:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+
+    def load_data(self, name):
+        # Service models, their extras and files like `endpoints` are all read through here.
+        return self._cached(name, lambda: super(CachedLoader, self).load_data(name))
+
+
+def create_session(profile=None):
+    """botocore session whose models are read through `CachedLoader`.
+
+    Models from `AWS_DATA_PATH` are never cached.
+    """
+    session = botocore.session.Session(profile=profile)
+
+    def loader():
+        data_path = session.get_config_variable('data_path')
+        if data_path:
+            return create_loader(data_path)
+        return CachedLoader()
+
+    session.lazy_register_component('data_loader', loader)
+    return session
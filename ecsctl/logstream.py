@@ -0,0 +1,344 @@
+import re
+import time
+import heapq
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from botocore.exceptions import ClientError
+
+from .exceptions import BotoWrapperException
+
+__all__ = ['LogStream', 'LogFollower', 'LogsInsightsQuery', 'task_log_streams', 'container_log_prefixes', 'format_event', 'merge_events',
+           'PrefetchedStream', 'is_missing_stream']
+
+
+# Events returned by the first `get_log_events` call of a stream when no start time is given.
+TAIL_EVENTS = 500
+# Rows returned by a Logs Insights query, by default and at most.
+INSIGHTS_LIMIT = 1000
+INSIGHTS_MAX_LIMIT = 10000
+# Seconds between `get_query_results` calls; doubled up to the maximum while the query runs.
+INSIGHTS_POLL_MIN, INSIGHTS_POLL_MAX = 0.5, 5
+# Pages fetched ahead of the reader for every stream.
+PREFETCH_PAGES = 4
+# Polls between two checks whether streams which did not exist yet have been created.
+DISCOVER_EVERY = 10
+# CloudWatch accepts events up to 2 hours newer than the time they are ingested (milliseconds).
+INGESTION_MARGIN = 2 * 60 * 60 * 1000
+
+
+def is_missing_stream(err):
+    """True for the error CloudWatch raises for a log stream which was never created."""
+    return isinstance(err, ClientError) and err.response['Error']['Code'] == 'ResourceNotFoundException'
+
+
+def format_event(event):
+    container_name = '\033[94m[{}]\033[0m '.format(event.get('logStreamName').split('/')[0])
+    timestamp = '\033[93m{}\033[0m '.format(
+        datetime.fromtimestamp(int(str(event.get('timestamp'))[:-3])).strftime('%Y-%m-%d %H:%M:%S'))
+    return '{}{}{}'.format(container_name, timestamp, event.get('message'))
+
+
+def merge_events(streams):
+    """Merge iterators of events, each already in timestamp order, into one ordered iterator.
+
+    Events are yielded as soon as every stream has produced its next one, and
+    only that next event per stream is held in the heap. Events with the same
+    timestamp keep the order of `streams`.
+    """
+    return heapq.merge(*streams, key=itemgetter('timestamp'))
+
+
+class PrefetchedStream:
+    """Events of one stream, with the next pages fetched ahead on `executor`.
+
+    `fetch_page(token)` returns `(events, next_token)`; `next_token` is None
+    after the last page. Every job fetches a single page, so a stream whose
+    buffer is full (`depth` pages) never holds a worker while it waits for the
+    reader, and a pool smaller than the number of streams can't deadlock a
+    merge that needs the head of every stream.
+    """
+
+    def __init__(self, executor, fetch_page, depth=PREFETCH_PAGES):
+        self._executor = executor
+        self._fetch_page = fetch_page
+        self._depth = depth
+        self._pages = deque()
+        self._token = None
+        self._fetching = False
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+        with self._condition:
+            self._schedule()
+
+    def _schedule(self):
+        if self._done or self._fetching or len(self._pages) >= self._depth:
+            return
+        self._fetching = True
+        self._executor.submit(self._fetch)
+
+    def _fetch(self):
+        try:
+            events, token = self._fetch_page(self._token)
+        except Exception as err:
+            events, token, error = [], None, err
+        else:
+            error = None
+        with self._condition:
+            self._fetching = False
+            self._token, self._error = token, error
+            if events:
+                self._pages.append(events)
+            if token is None:
+                self._done = True
+            self._schedule()
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._done = True
+            self._pages.clear()
+
+    def __iter__(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._pages and not self._done:
+                        self._condition.wait()
+                    if self._pages:
+                        page = self._pages.popleft()
+                        self._schedule()
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield from page
+        finally:
+            self.close()
+
+
+class LogStream:
+    """One `awslogs` stream: `<awslogs-stream-prefix>/<container name>/<task id>`."""
+
+    def __init__(self, group, name, container):
+        self.group = group
+        self.name = name
+        self.container = container
+        self.exists = False
+        self.token = None
+
+    def __repr__(self):
+        return 'LogStream({!r}, {!r})'.format(self.group, self.name)
+
+
+def container_log_prefixes(task_definition, container=None):
+    """`(container, awslogs-group, '<prefix>/<container>/')` for every container logging to CloudWatch.
+
+    Returns `(prefixes, info)`, where `info` lists `(container, message)` for
+    containers which don't log to CloudWatch.
+    """
+    prefixes, info, containers = [], [], []
+    for definition in task_definition['containerDefinitions']:
+        name = definition.get('name')
+        containers.append(name)
+        if container and name != container:
+            continue
+        log_configuration = definition.get('logConfiguration', {})
+        options = log_configuration.get('options', {})
+        if log_configuration.get('logDriver') != 'awslogs':
+            info.append((name, 'Log configuration driver is not `logDriver`.'))
+        elif not options.get('awslogs-group'):
+            info.append((name, 'Log configuration don\'t have `awslogs-group` configuration.'))
+        elif not options.get('awslogs-stream-prefix'):
+            info.append((name, 'Log configuration don\'t have `awslogs-stream-prefix` configuration.'))
+        else:
+            prefixes.append((name, options['awslogs-group'], '{}/{}/'.format(options['awslogs-stream-prefix'], name)))
+
+    if container and container not in containers:
+        raise BotoWrapperException('Select existing container: {}'.format(', '.join(containers)))
+    return prefixes, info
+
+
+def task_log_streams(bw, task, cluster, container=None):
+    """Resolve the log streams of a task from its task definition.
+
+    Returns `(streams, info)` like `container_log_prefixes`.
+    """
+    _task = bw.describe_task(task, cluster=cluster, simple=True)
+    task_id = _task['taskArn'].split('/')[-1]
+    task_definition = bw.describe_task_definition(_task['taskDefinitionArn'], cluster=cluster)
+    prefixes, info = container_log_prefixes(task_definition, container)
+    streams = [LogStream(group, prefix + task_id, name) for name, group, prefix in prefixes]
+    return streams, info
+
+
+class LogFollower:
+    """Tails a fixed set of log streams.
+
+    Every poll costs one `get_log_events` per existing stream, continued from
+    the stream's `nextForwardToken`, so no event is skipped or printed twice.
+    Streams which don't exist yet (the container has not logged anything) are
+    looked up by name every `discover_every` polls. With `filter_pattern` each
+    log group costs one `filter_log_events` per poll instead.
+    """
+
+    def __init__(self, logs_client, streams, start_time=None, filter_pattern=None, interval=1,
+                 tail=TAIL_EVENTS, discover_every=DISCOVER_EVERY):
+        self.logs_client = logs_client
+        self.streams = streams
+        self.start_time = start_time
+        self.filter_pattern = filter_pattern
+        self.interval = interval
+        self.tail = tail
+        self.discover_every = discover_every
+        self.polls = 0
+        # Per log group: newest timestamp printed, event ids printed at that timestamp and a query in progress.
+        self._filter_state = {}
+
+    def discover(self):
+        for stream in self.streams:
+            if stream.exists:
+                continue
+            resp = self.logs_client.describe_log_streams(
+                logGroupName=stream.group, logStreamNamePrefix=stream.name, limit=1)
+            stream.exists = any(s['logStreamName'] == stream.name for s in resp['logStreams'])
+
+    def poll(self):
+        """Return the events written since the last poll, oldest first."""
+        if self.polls % self.discover_every == 0:
+            self.discover()
+        self.polls += 1
+        if self.filter_pattern:
+            events = self._poll_filtered()
+        else:
+            events = []
+            for stream in self.streams:
+                if stream.exists:
+                    events.extend(self._poll_stream(stream))
+        events.sort(key=lambda event: event['timestamp'])
+        return events
+
+    def _poll_stream(self, stream):
+        kwargs = {'logGroupName': stream.group, 'logStreamName': stream.name, 'startFromHead': True}
+        if stream.token:
+            kwargs['nextToken'] = stream.token
+        elif self.start_time is not None:
+            kwargs['startTime'] = self.start_time
+        else:
+            kwargs.update(startFromHead=False, limit=self.tail)
+        try:
+            resp = self.logs_client.get_log_events(**kwargs)
+        except ClientError as err:
+            if not is_missing_stream(err):
+                raise
+            stream.exists, stream.token = False, None
+            return []
+        stream.token = resp['nextForwardToken']
+        for event in resp['events']:
+            event['logStreamName'] = stream.name
+        return resp['events']
+
+    def _poll_filtered(self):
+        events = []
+        groups = {}
+        for stream in self.streams:
+            if stream.exists:
+                groups.setdefault(stream.group, []).append(stream.name)
+        for group, names in groups.items():
+            state = self._filter_state.get(group)
+            if state is None:
+                start_time = self.start_time if self.start_time is not None else int(time.time() * 1000)
+                state = self._filter_state[group] = {'cursor': start_time, 'seen': set(), 'query': None}
+            # A query is paged with `nextToken` until it is exhausted, then the
+            # next one starts at the newest timestamp printed so far.
+            kwargs = state['query'] or {'logGroupName': group, 'logStreamNames': names,
+                                        'startTime': state['cursor'], 'filterPattern': self.filter_pattern}
+            resp = self.logs_client.filter_log_events(**kwargs)
+            for event in resp['events']:
+                if event['eventId'] in state['seen']:
+                    continue
+                if event['timestamp'] > state['cursor']:
+                    state['cursor'], state['seen'] = event['timestamp'], set()
+                state['seen'].add(event['eventId'])
+                events.append(event)
+            state['query'] = dict(kwargs, nextToken=resp['nextToken']) if resp.get('nextToken') else None
+        return events
+
+    def follow(self):
+        while True:
+            yield from self.poll()
+            time.sleep(self.interval)
+
+
+class LogsInsightsQuery:
+    """One CloudWatch Logs Insights query over the streams under `prefixes`.
+
+    `prefixes` are `(log group, stream name prefix)` pairs, so a whole
+    service or family is searched with a single `start_query` however many
+    tasks wrote to it. `pattern` is a regular expression matched against the
+    message on the server. Results are polled with exponential backoff; when
+    more than `limit` events match, the most recent ones are returned.
+    """
+
+    def __init__(self, logs_client, prefixes, start_time, end_time, pattern=None, limit=INSIGHTS_LIMIT,
+                 sleep=time.sleep):
+        self.logs_client = logs_client
+        self.log_groups = sorted({group for group, _ in prefixes})
+        self.prefixes = sorted({prefix for _, prefix in prefixes})
+        self.start_time = start_time
+        self.end_time = end_time
+        self.pattern = pattern
+        self.limit = limit
+        self.sleep = sleep
+        self.statistics = {}
+
+    @staticmethod
+    def _regex(pattern):
+        return '/{}/'.format(pattern.replace('/', '\\/'))
+
+    @property
+    def query_string(self):
+        streams = '|'.join(re.escape(prefix) for prefix in self.prefixes)
+        lines = ['fields @timestamp, @message, @logStream',
+                 'filter @logStream like {}'.format(self._regex('^({})'.format(streams)))]
+        if self.pattern:
+            lines.append('filter @message like {}'.format(self._regex(self.pattern)))
+        # Newest first, so a search capped by `limit` keeps the most recent events.
+        lines += ['sort @timestamp desc', 'limit {}'.format(self.limit)]
+        return ' | '.join(lines)
+
+    def results(self):
+        """Run the query and return its events, oldest first."""
+        query_id = self.logs_client.start_query(
+            logGroupNames=self.log_groups,
+            startTime=int(self.start_time.timestamp()),
+            endTime=int(self.end_time.timestamp()),
+            queryString=self.query_string,
+            limit=self.limit,
+        )['queryId']
+
+        delay = INSIGHTS_POLL_MIN
+        try:
+            while True:
+                resp = self.logs_client.get_query_results(queryId=query_id)
+                self.statistics = resp.get('statistics', {})
+                if resp['status'] == 'Complete':
+                    break
+                if resp['status'] not in ('Scheduled', 'Running'):
+                    raise BotoWrapperException('Logs Insights query {}: {}'.format(query_id, resp['status']))
+                self.sleep(delay)
+                delay = min(delay * 2, INSIGHTS_POLL_MAX)
+        except KeyboardInterrupt:
+            self.logs_client.stop_query(queryId=query_id)
+            raise
+        return [self._event(row) for row in reversed(resp['results'])]
+
+    @staticmethod
+    def _event(row):
+        fields = {field['field']: field['value'] for field in row}
+        timestamp = datetime.strptime(fields['@timestamp'], '%Y-%m-%d %H:%M:%S.%f').replace(tzinfo=timezone.utc)
+        return {'timestamp': int(timestamp.timestamp() * 1000), 'message': fields.get('@message', ''),
+                'logStreamName': fields.get('@logStream', '')}
@@ -0,0 +1,119 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+__all__ = ['STATISTICS', 'SeriesStore', 'choose_period', 'summarize', 'utilization', 'format_percent']
+
+
+# Statistics `top` can report for every metric, in display order.
+STATISTICS = ['avg', 'p50', 'p95', 'max']
+# Periods `top` queries with; the shortest one keeping a series under `MAX_DATAPOINTS` is used.
+PERIODS = [60, 300, 900, 1800, 3600, 10800, 21600, 43200, 86400]
+MAX_DATAPOINTS = 1440
+# Shortest period CloudWatch keeps for data of a given age (seconds): 1 minute for 15 days,
+# 5 minutes for 63 days and 1 hour for 455 days.
+RETENTION = [(15 * 86400, 60), (63 * 86400, 300), (455 * 86400, 3600)]
+
+
+def choose_period(start_time, end_time, now=None):
+    """Period (in seconds) for a series between `start_time` and `end_time`.
+
+    It is the shortest period CloudWatch still keeps for data as old as
+    `start_time` which returns at most `MAX_DATAPOINTS` datapoints.
+    """
+    now = now or datetime.now(timezone.utc)
+    age = (now - start_time).total_seconds()
+    minimum = next((period for kept, period in RETENTION if age <= kept), RETENTION[-1][1])
+    window = (end_time - start_time).total_seconds()
+    for period in PERIODS:
+        if period >= minimum and window / period <= MAX_DATAPOINTS:
+            return period
+    return int(math.ceil(window / MAX_DATAPOINTS / PERIODS[-1])) * PERIODS[-1]
+
+
+def _percentile(ordered, q):
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values, stats=STATISTICS):
+    """`{stat: value}` for the datapoints of one series; every value is None for an empty series."""
+    if not values:
+        return {stat: None for stat in stats}
+    ordered = sorted(values)
+    reducers = {
+        'avg': lambda: sum(ordered) / len(ordered),
+        'p50': lambda: _percentile(ordered, 0.5),
+        'p95': lambda: _percentile(ordered, 0.95),
+        'max': lambda: ordered[-1],
+    }
+    return {stat: reducers[stat]() for stat in stats}
+
+
+def utilization(used, reserved):
+    """Datapoints of the `used` series as percent of the `reserved` series at the same timestamps."""
+    reserved_at = dict(zip(reserved.get('Timestamps', []), reserved.get('Values', [])))
+    return [value * 100 / reserved_at[timestamp]
+            for timestamp, value in zip(used.get('Timestamps', []), used.get('Values', []))
+            if reserved_at.get(timestamp)]
+
+
+def format_percent(value):
+    return 'none' if value is None else '{:.2f}%'.format(value)
+
+
+class SeriesStore:
+    """Metric series kept in memory between the refreshes of `top --watch`.
+
+    `fetch(queries, start_time, end_time)` is `BotoWrapper.get_metric_data`.
+    Series are keyed by their `MetricStat`, so query Ids may change between
+    refreshes. A query seen before is only asked for the datapoints since
+    the newest one stored (the last period is fetched again, as it may have
+    been incomplete); new queries are fetched for the whole window, and
+    datapoints which slid out of the window are dropped.
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.series = {}
+        self.newest = None
+
+    @staticmethod
+    def _key(query):
+        return json.dumps(query['MetricStat'], sort_keys=True)
+
+    def _store(self, queries, results):
+        for query in queries:
+            series = self.series.setdefault(self._key(query), {})
+            result = results.get(query['Id'], {})
+            for timestamp, value in zip(result.get('Timestamps', []), result.get('Values', [])):
+                series[timestamp] = value
+                if self.newest is None or timestamp > self.newest:
+                    self.newest = timestamp
+
+    def get_metric_data(self, queries, start_time, end_time):
+        keys = {self._key(query) for query in queries}
+        self.series = {key: series for key, series in self.series.items() if key in keys}
+        known = [query for query in queries if self._key(query) in self.series]
+        new = [query for query in queries if self._key(query) not in self.series]
+
+        if known:
+            since = start_time
+            if self.newest is not None:
+                period = max(query['MetricStat']['Period'] for query in known)
+                since = max(start_time, self.newest - timedelta(seconds=period))
+            self._store(known, self.fetch(known, since, end_time))
+        if new:
+            self._store(new, self.fetch(new, start_time, end_time))
+
+        results = {}
+        for query in queries:
+            series = self.series[self._key(query)]
+            for timestamp in [t for t in series if t < start_time]:
+                del series[timestamp]
+            timestamps = sorted(series, reverse=True)
+            results[query['Id']] = {'Id': query['Id'], 'Timestamps': timestamps,
+                                    'Values': [series[t] for t in timestamps]}
+        return results
@@ -0,0 +1,98 @@
+from functools import lru_cache
+
+from jsonpath_ng import parse
+
+from . import exceptions
+
+__all__ = ['compile_path', 'Column', 'sort_records', 'parse_custom_columns', 'project']
+
+
+MISSING = '<none>'
+
+
+@lru_cache(maxsize=None)
+def compile_path(expression):
+    """Parse a JSONPath expression once. Paths are evaluated per record, so a leading
+    `[*].`, `$[*].`, `$.` or `.` is dropped."""
+    expression = expression.strip()
+    for prefix in ('$[*].', '[*].', '$.', '.'):
+        if expression.startswith(prefix):
+            expression = expression[len(prefix):]
+            break
+    try:
+        return parse(expression)
+    except Exception as err:
+        raise exceptions.QueryException('Invalid JSONPath expression `{}`: {}'.format(expression, err))
+
+
+class Column:
+
+    def __init__(self, expression, header=None):
+        self.expression = expression
+        self.path = compile_path(expression)
+        self.header = header or str(self.path).split('.')[-1]
+
+    def values(self, record):
+        return [match.value for match in self.path.find(record)]
+
+    def first(self, record, default=None):
+        values = self.values(record)
+        return values[0] if values else default
+
+    def display(self, record):
+        values = self.values(record)
+        if not values:
+            return MISSING
+        if len(values) == 1:
+            return values[0]
+        return ','.join(str(v) for v in values)
+
+
+class SortKey(Column):
+    """One `--sort-by` field. `-field` or `field:desc` sorts descending."""
+
+    def __init__(self, expression):
+        descending = False
+        if expression.startswith('-'):
+            expression, descending = expression[1:], True
+        elif expression.lower().endswith((':desc', ':asc')):
+            expression, _, order = expression.rpartition(':')
+            descending = order.lower() == 'desc'
+        super(SortKey, self).__init__(expression)
+        self.descending = descending
+
+    def key(self, record):
+        # Records without the field are always listed last.
+        values = self.values(record)
+        if not values:
+            return (0, 0) if self.descending else (1, 0)
+        return (1, values[0]) if self.descending else (0, values[0])
+
+
+def sort_records(records, sort_by):
+    """Sort `records` in place by a comma separated list of sort keys, e.g. `status,-createdAt`."""
+    keys = [SortKey(expression) for expression in sort_by.split(',') if expression.strip()]
+    for sort_key in reversed(keys):
+        extracted = [(sort_key.key(record), record) for record in records]
+        try:
+            extracted.sort(key=lambda item: item[0], reverse=sort_key.descending)
+        except TypeError:
+            extracted.sort(key=lambda item: (item[0][0], str(item[0][1])), reverse=sort_key.descending)
+        records[:] = [record for _, record in extracted]
+    return records
+
+
+def parse_custom_columns(spec):
+    """Parse `HEADER:PATH,HEADER:PATH` (the part after `custom-columns=`)."""
+    columns = []
+    for item in spec.split(','):
+        header, sep, expression = item.partition(':')
+        if not sep or not header or not expression:
+            raise exceptions.QueryException(
+                'Invalid custom column `{}`. Use `HEADER:JSONPATH`, e.g. `NAME:.serviceName`.'.format(item))
+        columns.append(Column(expression, header))
+    return columns
+
+
+def project(records, columns):
+    return [[column.display(record) for column in columns] for record in records]
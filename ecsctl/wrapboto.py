@@ -1,105 +1,251 @@
 import re
 import boto3
+import itertools
+import botocore.session
+import threading
 
 import stringcase
 import oyaml as yaml
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
+from botocore.credentials import RefreshableCredentials
 from botocore.exceptions import ClientError, ParamValidationError
 
-from . import template, config
-
-
-class BotoWrapperException(Exception):
-    pass
+from . import template, config, loader, logstream, grep, metrics
+from .cache import Cache
+from .exceptions import BotoWrapperException
+
+
+MAX_WORKERS = 10
+TASK_DEFINITION_REVISION = re.compile(r'.+:\d+$')
+# Task definition fields which change after registration; they are never cached.
+TASK_DEFINITION_MUTABLE_FIELDS = ['status', 'deregisteredAt', 'deleteRequestedAt']
+# Age after which the task definition family index is rebuilt, to pick up deregistrations made outside ecsctl.
+FAMILY_INDEX_TTL = timedelta(minutes=15)
+# Matches botocore's advisory refresh window, so refreshed credentials are never considered stale.
+REFRESH_BEFORE_EXPIRY = timedelta(minutes=15)
+EC2_INSTANCE_FIELDS = ['InstanceId', 'ImageId', 'InstanceType', 'InstanceLifecycle', 'PrivateIpAddress',
+                       'PublicIpAddress', 'Placement', 'State', 'LaunchTime', 'Tags']
+# Queries allowed in one `get_metric_data` call.
+METRIC_DATA_QUERIES = 500
+# Services named in one Metrics Insights `WHERE` clause (a query is limited to 2000 characters).
+INSIGHTS_SERVICES_PER_QUERY = 20
+SERVICE_METRICS = {'cpu': 'CPUUtilization', 'memory': 'MemoryUtilization'}
+# CloudWatch agent metrics of container instances and their `top` columns.
+INSTANCE_METRICS = [('mem_used_percent', 'MemoryUtilization'), ('swap_used_percent', 'SwapUsedPercent'),
+                    ('disk_used_percent', 'DiskUsedPercent')]
+METRIC_DISCOVERY_TTL = timedelta(hours=1)
+# Container Insights (enhanced observability) metrics of a task; container metrics have the `Container` prefix.
+TASK_METRICS = [('CPU', 'CpuUtilized', 'CpuReserved'), ('MEMORY', 'MemoryUtilized', 'MemoryReserved')]
+
+
+def temporary_credentials(data, margin=REFRESH_BEFORE_EXPIRY):
+    """botocore credential metadata from cached `_aws_*` values, or None when they
+    are missing or expire within `margin`."""
+    if not all(data.get(key) for key in config.TEMPORARY_KEYS):
+        return None
+    expiration = datetime.fromisoformat(data['_aws_expiration'])
+    if expiration.tzinfo is None:
+        # Written by older versions in local time.
+        expiration = expiration.astimezone()
+    if expiration - margin <= datetime.now(timezone.utc):
+        return None
+    return {'access_key': data['_aws_access_key_id'],
+            'secret_key': data['_aws_secret_access_key'],
+            'token': data['_aws_session_token'],
+            'expiry_time': expiration.isoformat()}
+
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def metric_query(query_id, namespace, metric_name, dimensions, period, stat='Average', unit='Percent'):
+    metric_stat = {
+        'Metric': {'Namespace': namespace, 'MetricName': metric_name, 'Dimensions': dimensions},
+        'Period': period,
+        'Stat': stat,
+    }
+    if unit:
+        metric_stat['Unit'] = unit
+    return {'Id': query_id, 'MetricStat': metric_stat, 'ReturnData': True}
+
+
+class LazyClient:
+    """boto3 client created on first access and then kept on the instance."""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with instance._session_lock:
+            client = instance.__dict__.get(self.name)
+            if client is None:
+                client = instance.session.client(self.service_name)
+                instance.__dict__[self.name] = client
+        return client
 
 
 class BotoWrapper:
+    ecs_client = LazyClient('ecs')
+    ec2_client = LazyClient('ec2')
+    logs_client = LazyClient('logs')
+    cloudwatch = LazyClient('cloudwatch')
+    servicediscovery = LazyClient('servicediscovery')
+    ssm = LazyClient('ssm')
+    sts = LazyClient('sts')
+    elb = LazyClient('elbv2')
+    route53 = LazyClient('route53')
 
     def __init__(self, session=None, *args, **kwargs):
-        if not session:
-            session = self.prepare_session(**kwargs)
-        self.session = session
-        self.ecs_client = session.client('ecs')
-        self.ec2_client = session.client('ec2')
-        self.logs_client = session.client('logs')
-        self.cloudwatch = session.client('cloudwatch')
-        self.servicediscovery = session.client('servicediscovery')
-        self.ssm = session.client('ssm')
-        self.sts = session.client('sts')
-        self.elb = session.client('elbv2')
-        self.route53 = session.client('route53')
+        self.max_workers = int(kwargs.pop('max_workers', None) or MAX_WORKERS)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._worker = threading.local()
+        self.use_cache = kwargs.pop('use_cache', True)
+        self.task_definition_cache = Cache('task-definitions', enabled=self.use_cache)
+        # Always written, so a `--no-cache` run replaces a stale index instead of leaving it.
+        self.task_definition_family_index = Cache('task-definition-families')
+        self.metric_dimension_cache = Cache('metric-dimensions', enabled=self.use_cache)
+        self._account_id = None
+        # The session (and a possible STS assume-role or MFA prompt) is only prepared on first use.
+        self._session = session
+        self._session_kwargs = kwargs
+        self._session_lock = threading.RLock()
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                self._session = self.prepare_session(**self._session_kwargs)
+        return self._session
+
+    def botocore_session(self, profile=None):
+        if self.use_cache:
+            return loader.create_session(profile)
+        return botocore.session.Session(profile=profile)
 
     def prepare_session(self, **kwargs):
-        aws_access_key_id, aws_secret_access_key, aws_session_token, \
-        aws_region_name, aws_profile_name = self.assumrole(**kwargs)
-
-        return boto3.session.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            aws_session_token=aws_session_token,
-            region_name=aws_region_name,
-            profile_name=aws_profile_name)
-
-    def assumrole(self, **kwargs):
-        aws_access_key_id = kwargs.get('aws_access_key_id')
-        aws_secret_access_key = kwargs.get('aws_secret_access_key')
-        aws_session_token = kwargs.get('aws_session_token')
         aws_region_name = kwargs.get('aws_region')
         aws_profile_name = kwargs.get('aws_profile')
-        aws_mfa_serial = kwargs.get('aws_mfa_serial')
-        aws_role_arn = kwargs.get('aws_role_arn')
-        duration_seconds = kwargs.get('duration_seconds', 3600)
-        _expiration = kwargs.get('_aws_expiration', None)
-        _aws_access_key_id = kwargs.get('_aws_access_key_id', None)
-        _aws_secret_access_key = kwargs.get('_aws_secret_access_key', None)
-        _aws_session_token = kwargs.get('_aws_session_token', None)
-
-        if _expiration:
-            if datetime.now() < datetime.fromisoformat(_expiration) and \
-                    _aws_access_key_id and _aws_secret_access_key and _aws_session_token:
-                return _aws_access_key_id, _aws_secret_access_key, _aws_session_token, aws_region_name, aws_profile_name
-
-        session = boto3.session.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            aws_session_token=aws_session_token,
-            region_name=aws_region_name,
-            profile_name=aws_profile_name)
-        sts = session.client('sts')
-
-        if aws_mfa_serial:
-            mfa_otp = input("Enter the MFA code: ")
-            if aws_role_arn:
+        if not (kwargs.get('aws_mfa_serial') or kwargs.get('aws_role_arn')):
+            return boto3.session.Session(
+                aws_access_key_id=kwargs.get('aws_access_key_id'),
+                aws_secret_access_key=kwargs.get('aws_secret_access_key'),
+                aws_session_token=kwargs.get('aws_session_token'),
+                region_name=aws_region_name,
+                botocore_session=self.botocore_session(aws_profile_name))
+
+        # botocore calls `assumrole` again shortly before the credentials expire.
+        botocore_session = self.botocore_session(aws_profile_name)
+        botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+            metadata=self.assumrole(**kwargs),
+            refresh_using=partial(self.assumrole, **kwargs),
+            method='assume-role')
+        return boto3.session.Session(botocore_session=botocore_session, region_name=aws_region_name)
+
+    def assumrole(self, **kwargs):
+        """Temporary credentials for the role / MFA device of the current context.
+
+        Credentials are shared between processes through `config.CREDENTIALS_FILE`.
+        The file is only refreshed holding `config.credentials_lock()`, so parallel
+        invocations wait for one STS call instead of each making their own.
+        """
+        metadata = temporary_credentials(kwargs)
+        if metadata:
+            return metadata
+
+        context = config.get_default_context()
+        with config.credentials_lock():
+            metadata = temporary_credentials(config.read_credentials(context))
+            if metadata:
+                return metadata
+
+            aws_mfa_serial = kwargs.get('aws_mfa_serial')
+            aws_role_arn = kwargs.get('aws_role_arn')
+            duration_seconds = int(kwargs.get('duration_seconds', 3600))
+            session = boto3.session.Session(
+                aws_access_key_id=kwargs.get('aws_access_key_id'),
+                aws_secret_access_key=kwargs.get('aws_secret_access_key'),
+                aws_session_token=kwargs.get('aws_session_token'),
+                region_name=kwargs.get('aws_region'),
+                botocore_session=self.botocore_session(kwargs.get('aws_profile')))
+            sts = session.client('sts')
+
+            if aws_mfa_serial:
+                mfa_otp = input("Enter the MFA code: ")
+                if aws_role_arn:
+                    credentials = sts.assume_role(
+                        RoleArn=aws_role_arn,
+                        RoleSessionName='session',
+                        DurationSeconds=duration_seconds,
+                        SerialNumber=aws_mfa_serial,
+                        TokenCode=mfa_otp)
+                else:
+                    credentials = sts.get_session_token(
+                        DurationSeconds=duration_seconds,
+                        SerialNumber=aws_mfa_serial,
+                        TokenCode=mfa_otp)
+            else:
                 credentials = sts.assume_role(
                     RoleArn=aws_role_arn,
                     RoleSessionName='session',
-                    DurationSeconds=duration_seconds,
-                    SerialNumber=aws_mfa_serial,
-                    TokenCode=mfa_otp)
-            else:
-                credentials = sts.get_session_token(
-                    DurationSeconds=duration_seconds,
-                    SerialNumber=aws_mfa_serial,
-                    TokenCode=mfa_otp)
-        elif aws_role_arn:
-            credentials = sts.assume_role(
-                RoleArn=aws_role_arn,
-                RoleSessionName='session',
-                DurationSeconds=duration_seconds)
-
-        if aws_mfa_serial or aws_role_arn:
-            aws_access_key_id = credentials['Credentials']['AccessKeyId']
-            aws_secret_access_key = credentials['Credentials']['SecretAccessKey']
-            aws_session_token = credentials['Credentials']['SessionToken']
-            endtime = datetime.now() + timedelta(seconds=3600)
-            data = {'_aws_expiration': endtime.isoformat(),
-                    '_aws_session_token': aws_session_token,
-                    '_aws_access_key_id': aws_access_key_id,
-                    '_aws_secret_access_key': aws_secret_access_key}
-            config.update_config(config.get_default_context(), None, **data)
-
-        return aws_access_key_id, aws_secret_access_key, aws_session_token, aws_region_name, aws_profile_name
+                    DurationSeconds=duration_seconds)
+
+            data = {'_aws_expiration': credentials['Credentials']['Expiration'].isoformat(),
+                    '_aws_session_token': credentials['Credentials']['SessionToken'],
+                    '_aws_access_key_id': credentials['Credentials']['AccessKeyId'],
+                    '_aws_secret_access_key': credentials['Credentials']['SecretAccessKey']}
+            config.write_credentials(context, data)
+        return temporary_credentials(data, margin=timedelta(0))
+
+    @property
+    def account_id(self):
+        if self._account_id is None:
+            self._account_id = self.sts.get_caller_identity()['Account']
+        return self._account_id
+
+    @property
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ecsctl')
+        return self._executor
+
+    def _run_in_worker(self, func, item):
+        self._worker.active = True
+        try:
+            return func(item)
+        finally:
+            self._worker.active = False
+
+    def fan_out(self, func, items):
+        """Call `func` for every item on the shared executor.
+
+        Results are returned in the same order as `items`. The first raised
+        exception cancels batches which have not started yet and is re-raised.
+        Calls made from inside a worker run inline to avoid exhausting the pool.
+        """
+        items = list(items)
+        if len(items) <= 1 or self.max_workers <= 1 or getattr(self._worker, 'active', False):
+            return [func(item) for item in items]
+        futures = [self.executor.submit(self._run_in_worker, func, item) for item in items]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception() is not None:
+                for pending in not_done:
+                    pending.cancel()
+                raise future.exception()
+        return [future.result() for future in futures]
 
     def create_object(self, param, deploy=None, tmpl=None):
         func = getattr(self, '_execute_create_{}'.format(stringcase.snakecase(tmpl.template_name)))
@@ -116,217 +262,280 @@ class BotoWrapper:
         tmpl.run_after(resp, boto_wrapper=self)
         return resp
 
-    def get_service_metric_data(self, cluster, start_time, end_time):
-        data_queries = []
+    def get_metric_data(self, queries, start_time, end_time):
+        """Results of any number of `get_metric_data` queries, keyed by query `Id`.
+
+        Queries are sent in chunks of `METRIC_DATA_QUERIES` on the shared
+        executor and every chunk is paged with `NextToken`, so `Timestamps`
+        and `Values` hold the whole series, newest first.
+        """
+        def fetch(chunk):
+            results = {}
+            paginator = self.cloudwatch.get_paginator('get_metric_data')
+            for page in paginator.paginate(MetricDataQueries=chunk, StartTime=start_time, EndTime=end_time,
+                                           ScanBy='TimestampDescending'):
+                for result in page['MetricDataResults']:
+                    merged = results.setdefault(result['Id'], dict(result, Timestamps=[], Values=[]))
+                    merged['Timestamps'] += result['Timestamps']
+                    merged['Values'] += result['Values']
+                    merged['StatusCode'] = result['StatusCode']
+            return results
+
+        out = {}
+        for results in self.fan_out(fetch, batches(queries, METRIC_DATA_QUERIES)):
+            out.update(results)
+        return out
+
+    def get_service_metric_data(self, cluster, start_time, end_time, stats=metrics.STATISTICS, series=None):
+        period = metrics.choose_period(start_time, end_time)
+        data_queries, keys = [], {}
         for service_arn in self.all_service_arns(cluster=cluster):
             service = service_arn.split('/')[-1]
             for metrics_type in ['CPUUtilization', 'MemoryUtilization']:
-                data_queries.append({
-                    'Id': '{}-{}'.format(metrics_type.lower(), service).replace('-', '_'),
-                    'MetricStat': {
-                        'Metric': {
-                            'Namespace': 'AWS/ECS',
-                            'MetricName': metrics_type,
-                            'Dimensions': [
-                                {
-                                    'Name': 'ServiceName',
-                                    'Value': service
-                                },
-                                {
-                                    'Name': 'ClusterName',
-                                    'Value': cluster
-                                },
-                            ]
-                        },
-                        'Period': 1800,
-                        'Stat': 'Average',
-                        'Unit': 'Percent'
-                    },
-                    'ReturnData': True
-                })
+                query_id = 'm{}'.format(len(data_queries))
+                keys[query_id] = service, metrics_type
+                data_queries.append(metric_query(query_id, 'AWS/ECS', metrics_type, [
+                    {'Name': 'ServiceName', 'Value': service},
+                    {'Name': 'ClusterName', 'Value': cluster},
+                ], period=period))
 
         try:
-            response = self.cloudwatch.get_metric_data(
-                MetricDataQueries=data_queries,
-                StartTime=start_time,
-                EndTime=end_time,
-                ScanBy='TimestampDescending',
-                MaxDatapoints=100
-            )
+            response = (series or self).get_metric_data(data_queries, start_time, end_time)
         except ClientError as err:
             return str(err), True
 
         prepare = {}
-        for resp_metrics in response['MetricDataResults']:
-            service, metric = resp_metrics['Label'].split(' ')
-            if not service in prepare:
-                prepare[service] = {}
-            if 'CPUUtilization' == metric:
-                prepare[service]['CPUUtilization'] = resp_metrics['Values']
-            elif 'MemoryUtilization' == metric:
-                prepare[service]['MemoryUtilization'] = resp_metrics['Values']
+        for query_id, (service, metric) in keys.items():
+            prepare.setdefault(service, {})[metric] = response.get(query_id, {}).get('Values', [])
 
         output = []
         for key, values in prepare.items():
-            cpu, memory = 'none', 'none'
-            if len(values['CPUUtilization']) == 1:
-                cpu = '{:.2f}%'.format(values['CPUUtilization'][0])
-            if len(values['MemoryUtilization']) == 1:
-                memory = '{:.2f}%'.format(values['MemoryUtilization'][0])
-            output.append((key, cpu, memory))
+            row = [key]
+            for metric in ['CPUUtilization', 'MemoryUtilization']:
+                summary = metrics.summarize(values[metric], stats)
+                row += [metrics.format_percent(summary[stat]) for stat in stats]
+            output.append(tuple(row))
         return output, False
 
-    def get_container_instance_metric_data(self, cluster, start_time, end_time):
-        data_queries, instance_id, node = [], {}, None
-        for data_node in self.get_container_instances(cluster=cluster, ec2_detail=True):
-            node = data_node['ec2InstanceId']
+    def get_metric_insights(self, expressions, period, start_time, end_time):
+        """Series of CloudWatch Metrics Insights queries, keyed by label.
 
-            try:
-                dimensions = [
-                    {'Name': 'InstanceId', 'Value': node},
-                    {'Name': 'AutoScalingGroupName', 'Value': list(filter(
-                        lambda x: x['Key'] == 'aws:autoscaling:groupName', data_node['ec2_data']['Tags']))[0]['Value']},
-                    {'Name': 'ImageId', 'Value': data_node['ec2_data']['ImageId']},
-                    {'Name': 'InstanceType', 'Value': data_node['ec2_data']['InstanceType']}
-                ]
-            except (IndexError, KeyError) as e:
-                dimensions = []
+        A query with `GROUP BY` returns one series per group, labelled with
+        the group's dimension values, in the query's `ORDER BY` order.
+        """
+        queries = [{'Id': 'q{}'.format(i), 'Expression': expression, 'Period': period, 'ReturnData': True}
+                   for i, expression in enumerate(expressions)]
+        out = {}
+        paginator = self.cloudwatch.get_paginator('get_metric_data')
+        for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time,
+                                       ScanBy='TimestampDescending'):
+            for result in page['MetricDataResults']:
+                out.setdefault(result['Label'], []).extend(result['Values'])
+        return out
+
+    def get_top_service_metric_data(self, cluster, start_time, end_time, sort='cpu', limit=20,
+                                    stats=metrics.STATISTICS, series=None):
+        """`get_service_metric_data` for the `limit` services with the highest average `sort` metric.
 
+        The ranking is done by Metrics Insights (`ORDER BY AVG() DESC LIMIT`),
+        so it costs one query whatever the number of services, plus one query
+        per `INSIGHTS_SERVICES_PER_QUERY` services for the other metric.
+        Insights series are not incremental, so `series` is not used.
+        """
+        period = metrics.choose_period(start_time, end_time)
+        select = 'SELECT AVG({}) FROM SCHEMA("AWS/ECS", ClusterName, ServiceName) WHERE ClusterName = \'{}\''
+        sort_metric = SERVICE_METRICS[sort]
+        prepare = {}
+        try:
+            prepare[sort_metric] = self.get_metric_insights(
+                [select.format(sort_metric, cluster) + ' GROUP BY ServiceName ORDER BY AVG() DESC LIMIT {}'.format(limit)],
+                period, start_time, end_time)
+            services = list(prepare[sort_metric])
+            for metric in SERVICE_METRICS.values():
+                if metric == sort_metric:
+                    continue
+                expressions = []
+                for batch in batches(services, INSIGHTS_SERVICES_PER_QUERY):
+                    names = ' OR '.join('ServiceName = \'{}\''.format(service) for service in batch)
+                    expressions.append(select.format(metric, cluster) + ' AND ({}) GROUP BY ServiceName'.format(names))
+                prepare[metric] = self.get_metric_insights(expressions, period, start_time, end_time) if expressions else {}
+        except ClientError as err:
+            return str(err), True
+
+        rows = []
+        for service in services:
+            row = [service]
+            for metric in SERVICE_METRICS.values():
+                summary = metrics.summarize(prepare[metric].get(service), stats)
+                row += [metrics.format_percent(summary[stat]) for stat in stats]
+            rank = metrics.summarize(prepare[sort_metric][service], ['avg'])['avg']
+            rows.append((-1 if rank is None else rank, tuple(row)))
+        rows.sort(key=lambda item: item[0], reverse=True)
+        return [row for _, row in rows], False
+
+    def get_task_metric_data(self, cluster, start_time, end_time, stats=metrics.STATISTICS, service=None,
+                             family=None, containers=False, series=None):
+        """CPU and memory used by every running task (or container), as percent of its reservation.
+
+        Reads the `ECS/ContainerInsights` task and container metrics, which
+        need Container Insights with enhanced observability on the cluster.
+        All queries go through `get_metric_data`, so hundreds of tasks take a
+        few calls. Rows are sorted by the first statistic of CPU usage.
+        """
+        period = metrics.choose_period(start_time, end_time)
+        filters = {}
+        if service:
+            filters['serviceName'] = service
+        if family:
+            filters['family'] = family
+
+        data_queries, keys, rows = [], {}, []
+        for task in self.get_tasks(cluster, 'RUNNING', **filters):
+            task_id = task['taskArn'].split('/')[-1]
+            dimensions = [
+                {'Name': 'ClusterName', 'Value': cluster},
+                {'Name': 'TaskDefinitionFamily', 'Value': task['taskDefinitionArn'].split('/')[-1].rsplit(':', 1)[0]},
+                {'Name': 'TaskId', 'Value': task_id},
+            ]
+            if containers:
+                targets = [(container['name'], 'Container', dimensions + [{'Name': 'ContainerName', 'Value': container['name']}])
+                           for container in task.get('containers', [])]
+            else:
+                targets = [(None, '', dimensions)]
+            for container, prefix, target_dimensions in targets:
+                row = task_id, task.get('group', ''), container
+                rows.append(row)
+                for column, utilized, reserved in TASK_METRICS:
+                    for metric_name in (utilized, reserved):
+                        query_id = 'm{}'.format(len(data_queries))
+                        keys[row, metric_name] = query_id
+                        data_queries.append(metric_query(query_id, 'ECS/ContainerInsights', prefix + metric_name,
+                                                         target_dimensions, period=period, unit=None))
+
+        try:
+            response = (series or self).get_metric_data(data_queries, start_time, end_time)
+        except ClientError as err:
+            return str(err), True
+
+        output = []
+        for row in rows:
+            line, rank = list(row if containers else row[:2]), None
+            for column, utilized, reserved in TASK_METRICS:
+                summary = metrics.summarize(metrics.utilization(response.get(keys[row, utilized], {}),
+                                                                response.get(keys[row, reserved], {})), stats)
+                line += [metrics.format_percent(summary[stat]) for stat in stats]
+                if rank is None:
+                    rank = summary[stats[0]]
+            output.append((-1 if rank is None else rank, tuple(line)))
+        output.sort(key=lambda item: item[0], reverse=True)
+        return [line for _, line in output], False
+
+    def discover_instance_metrics(self, cluster, instance_ids):
+        """Dimensions of the `INSTANCE_METRICS` of every instance, as `{metric: {InstanceId: dimensions}}`.
+
+        The CloudWatch agent adds dimensions depending on its configuration
+        and reports a disk metric for every mount (`/` is preferred), so they
+        are listed with `list_metrics` instead of guessed. Only metrics with
+        datapoints in the last 3 hours are listed. The result is cached per
+        cluster for `METRIC_DISCOVERY_TTL`, or until an instance which was not
+        listed joins the cluster.
+        """
+        key = '{}:{}:{}'.format(self.account_id, self.session.region_name, cluster)
+        wanted = set(instance_ids)
+        cached = self.metric_dimension_cache.get(key)
+        if (cached and cached['discovered'] > datetime.now(timezone.utc) - METRIC_DISCOVERY_TTL
+                and wanted <= set(cached['instances'])):
+            return cached['metrics']
+
+        def list_metrics(metric_name):
+            found = {}
+            paginator = self.cloudwatch.get_paginator('list_metrics')
+            pages = paginator.paginate(Namespace='ECSInstancesMetrics', MetricName=metric_name, RecentlyActive='PT3H')
+            for metric in pages.search('Metrics[]'):
+                values = {dimension['Name']: dimension['Value'] for dimension in metric['Dimensions']}
+                node = values.get('InstanceId')
+                if node in wanted and (node not in found or values.get('path') == '/'):
+                    found[node] = metric['Dimensions']
+            return found
+
+        names = [metric_name for metric_name, _ in INSTANCE_METRICS]
+        discovered = dict(zip(names, self.fan_out(list_metrics, names)))
+        self.metric_dimension_cache.set(key, {'discovered': datetime.now(timezone.utc), 'instances': sorted(wanted),
+                                              'metrics': discovered})
+        return discovered
+
+    def get_container_instance_metric_data(self, cluster, start_time, end_time, stats=metrics.STATISTICS, series=None):
+        period = metrics.choose_period(start_time, end_time)
+        nodes = [node for node in self.get_container_instances(cluster=cluster, ec2_detail=False)
+                 if node.get('ec2InstanceId')]
+        try:
+            discovered = self.discover_instance_metrics(cluster, [node['ec2InstanceId'] for node in nodes])
+        except ClientError as err:
+            return str(err), True
+
+        data_queries, keys, instance_id = [], {}, {}
+        for data_node in nodes:
+            node = data_node['ec2InstanceId']
             instance_id[node] = data_node['containerInstanceArn'].split('/')[-1]
-            for metrics_type in [
-                    ('AWS/EC2', 'CPUUtilization', [{'Name': 'InstanceId', 'Value': node}]),
-                    ('ECSInstancesMetrics', 'mem_used_percent', dimensions),
-                    ('ECSInstancesMetrics', 'swap_used_percent', dimensions),
-                    ('ECSInstancesMetrics', 'disk_used_percent', dimensions + [
-                        {"Name": "path", "Value": "/"},
-                        {'Name': 'fstype', 'Value': 'ext4'},
-                        {'Name': 'device', 'Value': 'nvme0n1p1'}])]:
-                data_queries.append({
-                    'Id': '{}___{}'.format(metrics_type[1].lower(), node).replace('-', '_'),
-                    'MetricStat': {
-                        'Metric': {
-                            'Namespace': metrics_type[0],
-                            'MetricName': metrics_type[1],
-                            'Dimensions': metrics_type[2]
-                        },
-                        'Period': 300,
-                        'Stat': 'Average',
-                        'Unit': 'Percent'
-                    },
-                    'ReturnData': True
-                })
+            targets = [('AWS/EC2', 'CPUUtilization', [{'Name': 'InstanceId', 'Value': node}], 'CPUUtilization')]
+            for metric_name, column in INSTANCE_METRICS:
+                # Metrics the agent doesn't report for this instance would only come back empty.
+                if node in discovered.get(metric_name, {}):
+                    targets.append(('ECSInstancesMetrics', metric_name, discovered[metric_name][node], column))
+            for namespace, metric_name, metric_dimensions, column in targets:
+                query_id = 'm{}'.format(len(data_queries))
+                keys[query_id] = node, column
+                data_queries.append(metric_query(query_id, namespace, metric_name, metric_dimensions, period=period))
 
         try:
-            response = self.cloudwatch.get_metric_data(
-                MetricDataQueries=data_queries,
-                StartTime=start_time,
-                EndTime=end_time,
-                ScanBy='TimestampDescending',
-                MaxDatapoints=100
-            )
+            response = (series or self).get_metric_data(data_queries, start_time, end_time)
         except ClientError as err:
             return str(err), True
 
         prepare = {}
-        for resp_metrics in response['MetricDataResults']:
-            _m, _i = resp_metrics.get('Id', '').split('___')
-            node = _i.replace('_', '-')
-            metric = resp_metrics['Label'].split(' ')[-1]
-            if not node in prepare:
-                prepare[node] = {}
-            if 'CPUUtilization' == metric:
-                prepare[node]['CPUUtilization'] = resp_metrics['Values']
-            elif 'mem_used_percent' == metric:
-                prepare[node]['MemoryUtilization'] = resp_metrics['Values']
-            elif 'disk_used_percent' == metric:
-                prepare[node]['DiskUsedPercent'] = resp_metrics['Values']
-            elif 'swap_used_percent' == metric:
-                prepare[node]['SwapUsedPercent'] = resp_metrics['Values']
+        for query_id, (node, column) in keys.items():
+            prepare.setdefault(node, {})[column] = response.get(query_id, {}).get('Values', [])
 
         output = []
         for key, values in prepare.items():
-            cpu, memory, disk, swap = 'none', 'none', 'none', 'none'
-            if len(values.get('CPUUtilization', '')) == 1:
-                cpu = '{:.2f}%'.format(values['CPUUtilization'][0])
-            if len(values.get('MemoryUtilization', '')) == 1:
-                memory = '{:.2f}%'.format(values['MemoryUtilization'][0])
-            if len(values.get('DiskUsedPercent', '')) == 1:
-                disk = '{:.2f}%'.format(values['DiskUsedPercent'][0])
-            if len(values.get('SwapUsedPercent', '')) == 1:
-                swap = '{:.2f}%'.format(values['SwapUsedPercent'][0])
-            output.append((instance_id.get(key, 'none'), key, cpu, memory, disk, swap))
+            row = [instance_id.get(key, 'none'), key]
+            for column in ['CPUUtilization', 'MemoryUtilization', 'DiskUsedPercent', 'SwapUsedPercent']:
+                summary = metrics.summarize(values.get(column), stats)
+                row += [metrics.format_percent(summary[stat]) for stat in stats]
+            output.append(tuple(row))
         return output, False
 
-    def get_cluster_metric_data(self, cluster, start_time, end_time):
-        #TODO: add reg exp fo get only letter from cluster name
-        data_queries = []
+    def get_cluster_metric_data(self, cluster, start_time, end_time, stats=metrics.STATISTICS, series=None):
+        period = metrics.choose_period(start_time, end_time)
+        data_queries, keys = [], {}
         for metrics_type in ['CPUUtilization', 'CPUReservation', 'MemoryUtilization', 'MemoryReservation']:
-            data_queries.append({
-                'Id': '{}-{}'.format(metrics_type.lower(), cluster).replace('-', '_'),
-                'MetricStat': {
-                    'Metric': {
-                        'Namespace': 'AWS/ECS',
-                        'MetricName': metrics_type,
-                        'Dimensions': [
-                            {
-                                'Name': 'ClusterName',
-                                'Value': cluster
-                            }
-                        ]
-                    },
-                    'Period': 1800,
-                    'Stat': 'Average',
-                    'Unit': 'Percent'
-                },
-                'ReturnData': True
-            })
+            query_id = 'm{}'.format(len(data_queries))
+            keys[query_id] = metrics_type
+            data_queries.append(metric_query(query_id, 'AWS/ECS', metrics_type, [
+                {'Name': 'ClusterName', 'Value': cluster},
+            ], period=period))
 
         try:
-            response = self.cloudwatch.get_metric_data(
-                MetricDataQueries=data_queries,
-                StartTime=start_time,
-                EndTime=end_time,
-                ScanBy='TimestampDescending',
-                MaxDatapoints=100
-            )
+            response = (series or self).get_metric_data(data_queries, start_time, end_time)
         except ClientError as err:
             return str(err), True
 
-        prepare = {}
-        for resp_metrics in response['MetricDataResults']:
-            metric = resp_metrics['Label']
-            if not cluster in prepare:
-                prepare[cluster] = {}
-            if 'CPUUtilization' == metric:
-                prepare[cluster]['CPUUtilization'] = resp_metrics['Values']
-            elif 'CPUReservation' == metric:
-                prepare[cluster]['CPUReservation'] = resp_metrics['Values']
-            elif 'MemoryUtilization' == metric:
-                prepare[cluster]['MemoryUtilization'] = resp_metrics['Values']
-            elif 'MemoryReservation' == metric:
-                prepare[cluster]['MemoryReservation'] = resp_metrics['Values']
+        prepare = {cluster: {}}
+        for query_id, metric in keys.items():
+            prepare[cluster][metric] = response.get(query_id, {}).get('Values', [])
 
         output = []
         for key, values in prepare.items():
-            cpu, cpu_res, memory, memory_res = 'none', 'none', 'none', 'none'
-            if len(values['CPUUtilization']) == 1:
-                cpu = '{:.2f}'.format(values['CPUUtilization'][0])
-            if len(values['CPUReservation']) == 1:
-                cpu_res = '{:.2f}'.format(values['CPUReservation'][0])
-            if len(values['MemoryUtilization']) == 1:
-                memory = '{:.2f}'.format(values['MemoryUtilization'][0])
-            if len(values['MemoryReservation']) == 1:
-                memory_res = '{:.2f}'.format(values['MemoryReservation'][0])
-            output.append((key, '{}%/{}%'.format(cpu_res, cpu), '{}%/{}%'.format(memory_res, memory)))
+            row = [key]
+            for reservation, utilization in [('CPUReservation', 'CPUUtilization'),
+                                             ('MemoryReservation', 'MemoryUtilization')]:
+                reserved = metrics.summarize(values[reservation], stats)
+                used = metrics.summarize(values[utilization], stats)
+                row += ['{}/{}'.format(metrics.format_percent(reserved[stat]), metrics.format_percent(used[stat]))
+                        for stat in stats]
+            output.append(tuple(row))
         return output, False
 
-    def describe_instance(self, instance_id):
-        try:
-            resp = self.ec2_client.describe_instances(InstanceIds=[instance_id])
-        except Exception as e:
-            return str(e)
-        return resp['Reservations'][0]['Instances'][0]
-
     def all_service_arns(self, cluster='default'):
         paginator = self.ecs_client.get_paginator('list_services')
         out = []
@@ -335,15 +544,16 @@ class BotoWrapper:
         return out
 
     def get_services(self, cluster='default'):
-        services = self.all_service_arns(cluster=cluster)
-        out = []
-        while services:
-            batch_services, services = services[:10], services[10:]
+        def describe(batch_services):
             resp = self.ecs_client.describe_services(
                 cluster=cluster,
                 services=batch_services,
             )
-            out += resp['services']
+            return resp['services']
+
+        out = []
+        for services in self.fan_out(describe, batches(self.all_service_arns(cluster=cluster), 10)):
+            out += services
         return out
 
     def describe_service(self, service, cluster='default'):
@@ -362,36 +572,36 @@ class BotoWrapper:
             out += page['containerInstanceArns']
         return out
 
+    def all_ec2_instances(self, instance_ids):
+        """Return EC2 instances keyed by `InstanceId`, trimmed to `EC2_INSTANCE_FIELDS`."""
+        out = {}
+        if not instance_ids:
+            return out
+        paginator = self.ec2_client.get_paginator('describe_instances')
+        pages = paginator.paginate(
+            Filters=[{'Name': 'instance-id', 'Values': instance_ids}],
+            PaginationConfig={'PageSize': 1000})
+        for instance in pages.search('Reservations[].Instances[]'):
+            out[instance['InstanceId']] = {k: instance[k] for k in EC2_INSTANCE_FIELDS if k in instance}
+        return out
+
     def get_container_instances(self, cluster='default', ec2_detail=True):
-        out = []
-        nodes = self.all_container_instance_arns(cluster=cluster)
-        while nodes:
-            response = {}
-            batch_nodes, nodes, output = nodes[:100], nodes[100:], []
-            output_ecs = self.ecs_client.describe_container_instances(
+        def describe(batch_nodes):
+            resp = self.ecs_client.describe_container_instances(
                 cluster=cluster,
                 containerInstances=batch_nodes,
             )
+            output = resp['containerInstances']
             if ec2_detail:
-                output_ec2 = self.ec2_client.describe_instances(
-                    InstanceIds=[x['ec2InstanceId'] for x in output_ecs['containerInstances']]
-                )
-                ecs = output_ecs['containerInstances']
-                ec2 = output_ec2['Reservations']
-                for ecs_inst, ec2_inst in zip(ecs, ec2):
-                    if not ecs_inst['ec2InstanceId'] in response:
-                        response[ecs_inst['ec2InstanceId']] = {}
-                    response[ecs_inst['ec2InstanceId']]['ECS'] = ecs_inst
-                    if not ec2_inst['Instances'][0]['InstanceId'] in response:
-                        response[ec2_inst['Instances'][0]['InstanceId']] = {}
-                    response[ec2_inst['Instances'][0]['InstanceId']]['EC2'] = ec2_inst['Instances'][0]
-                for instance_id, values in response.items():
-                    data = values['ECS']
-                    data['ec2_data'] = values['EC2']
-                    output.append(data)
-                out.extend(output)
-            else:
-                out = output_ecs['containerInstances']
+                ec2 = self.all_ec2_instances([x['ec2InstanceId'] for x in output if x.get('ec2InstanceId')])
+                for data in output:
+                    data['ec2_data'] = ec2.get(data.get('ec2InstanceId'), {})
+            return output
+
+        out = []
+        nodes = self.all_container_instance_arns(cluster=cluster)
+        for output in self.fan_out(describe, batches(nodes, 100)):
+            out.extend(output)
         return out
 
     def describe_container_instance(self, node, output='json', cluster='default'):
@@ -418,14 +628,15 @@ class BotoWrapper:
         return resp['clusterArns']
 
     def get_clusters(self):
-        clusters = self.all_cluster_arns()
-        out = []
-        while clusters:
-            batch_clusters, clusters = clusters[:10], clusters[10:]
+        def describe(batch_clusters):
             resp = self.ecs_client.describe_clusters(
                 clusters=batch_clusters,
             )
-            out += resp['clusters']
+            return resp['clusters']
+
+        out = []
+        for clusters in self.fan_out(describe, batches(self.all_cluster_arns(), 10)):
+            out += clusters
         return out
 
     def describe_cluster(self, cluster):
@@ -837,20 +1048,20 @@ class BotoWrapper:
         return self._execute_create_task_definition(task_definition)
 
     def update_task_definition(self, task_definition_familly, cluster, images_tags):
-        familie = self.all_task_definition_families(family_prefix=task_definition_familly)
-        if familie:
-            familly_name, last_task, count = familie[0]
-            task_definition, tags = self.describe_task_definition(last_task, cluster, tags=True)
-            task_definition = self.strip_task_def_data(task_definition)
-            if tags:
-                task_definition['tags'] = tags
-            for x, container in enumerate(task_definition.get('containerDefinitions')):
-                image_tag = images_tags.get(container.get('name'))
-                if image_tag:
-                    image = container['image'].split(':')[0]
-                    task_definition['containerDefinitions'][x]['image'] = '{}:{}'.format(image, image_tag)
-
-            return self._execute_create_task_definition(task_definition)
+        try:
+            task_definition, tags = self.describe_task_definition(task_definition_familly, cluster, tags=True)
+        except ClientError as err:
+            raise BotoWrapperException(str(err))
+        task_definition = self.strip_task_def_data(task_definition)
+        if tags:
+            task_definition['tags'] = tags
+        for x, container in enumerate(task_definition.get('containerDefinitions')):
+            image_tag = images_tags.get(container.get('name'))
+            if image_tag:
+                image = container['image'].split(':')[0]
+                task_definition['containerDefinitions'][x]['image'] = '{}:{}'.format(image, image_tag)
+
+        return self._execute_create_task_definition(task_definition)
 
     def _execute_create_service(self, param, deploy=None, tmpl=None, **kwargs):
         for x, service in enumerate(param.get('serviceRegistries', [])):
@@ -1040,6 +1251,10 @@ class BotoWrapper:
         except Exception as e:
             return str(e), True
 
+        self.task_definition_cache.delete(task_definition)
+        self.task_definition_cache.delete(resp['taskDefinition']['taskDefinitionArn'])
+        self.forget_task_definition_family(resp['taskDefinition']['family'])
+
         return resp['taskDefinition'], False
 
     def deregister_task_definition_family(self, task_definition_family):
@@ -1060,36 +1275,131 @@ class BotoWrapper:
             out += page['taskArns']
         return out
 
-    def get_tasks(self, cluster, status):
-        out, tasks = [], self.all_tasks(cluster=cluster, status=status)
+    def iter_tasks(self, cluster='default', status='RUNNING', **filters):
+        """Generate described tasks while `list_tasks` is still paginating.
+
+        Every page of task ARNs is sent to `describe_tasks` on the shared executor
+        as soon as it is listed, and tasks are yielded in listing order. `filters`
+        are extra `list_tasks` parameters, e.g. `serviceName` or `family`.
+        """
+        params = dict(cluster=cluster)
+        if status:
+            params['desiredStatus'] = status
+        params.update(filters)
 
-        while tasks:
-            batch_tasks, tasks = tasks[:100], tasks[100:]
+        def describe(batch_tasks):
             resp = self.ecs_client.describe_tasks(
                 tasks=batch_tasks,
                 cluster=cluster,
             )
-            out += resp['tasks']
+            return resp['tasks']
 
-        return out
+        if getattr(self._worker, 'active', False):
+            for page in self.ecs_client.get_paginator('list_tasks').paginate(**params):
+                if page['taskArns']:
+                    yield from describe(page['taskArns'])
+            return
+
+        pending = deque()
+        try:
+            paginator = self.ecs_client.get_paginator('list_tasks')
+            for page in paginator.paginate(**params):
+                if page['taskArns']:
+                    pending.append(self.executor.submit(self._run_in_worker, describe, page['taskArns']))
+                while pending and (pending[0].done() or len(pending) >= self.max_workers):
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def get_tasks(self, cluster, status, **filters):
+        return list(self.iter_tasks(cluster=cluster, status=status, **filters))
+
+    def _list_family_revisions(self, family, high_water_mark=0, status='ACTIVE'):
+        """Return (latest ARN, number of revisions newer than `high_water_mark`) of `family` in `status`.
+
+        `list_task_definitions` sorted DESC lists the newest revisions first, so
+        listing stops at the first revision which is already known; that one is
+        still returned as the latest when nothing newer exists. `familyPrefix`
+        also matches longer family names and those are skipped.
+        """
+        latest, count = None, 0
+        paginator = self.ecs_client.get_paginator('list_task_definitions')
+        for page in paginator.paginate(familyPrefix=family, status=status, sort='DESC'):
+            for arn in page['taskDefinitionArns']:
+                _family, _revision = arn.split('/')[-1].rsplit(':', 1)
+                if _family != family:
+                    continue
+                if latest is None:
+                    latest = arn
+                if int(_revision) <= high_water_mark:
+                    return latest, count
+                count += 1
+        return latest, count
+
+    def _family_index_key(self, status):
+        return '{}:{}:{}'.format(self.account_id, self.session.region_name, status)
+
+    def forget_task_definition_family(self, family):
+        """Drop `family` from the family indexes, so its revisions are listed again on the next lookup."""
+        for status in ('ACTIVE', 'INACTIVE'):
+            index_key = self._family_index_key(status)
+            index = self.task_definition_family_index.get(index_key)
+            if index and index.get('families', {}).pop(family, None) is not None:
+                self.task_definition_family_index.set(index_key, index)
 
     def all_task_definition_families(self, family_prefix=None, status='ALL'):
-        out = []
+        """Return `(family, latest task definition ARN, count of revisions)` for every family.
+
+        Revisions are counted in an index per account, region and revision
+        status, which only lists revisions newer than those already counted.
+        When the newest listed revision is older than the stored latest one
+        (it was deregistered), the family is counted again; other revisions
+        deregistered outside ecsctl are picked up when the index expires after
+        `FAMILY_INDEX_TTL`. With `--no-cache` the index is rebuilt and saved.
+        """
+        families = []
         paginator = self.ecs_client.get_paginator('list_task_definition_families')
         params = dict(status=status)
         if family_prefix is not None:
             params['familyPrefix'] = family_prefix
         for page in paginator.paginate(**params):
-            for familly in page['families']:
-                count = 0
-                last = 'EMPTY'
-                paginator_td = self.ecs_client.get_paginator('list_task_definitions')
-                for page in paginator_td.paginate(familyPrefix=familly, sort='DESC'):
-                    _len = len(page['taskDefinitionArns'])
-                    if last == 'EMPTY' and _len:
-                        last = page['taskDefinitionArns'][0]
-                    count += _len
-                out.append((familly, last, count))
+            families += page['families']
+        if not families:
+            return []
+
+        # Families of every status count their active revisions.
+        revision_status = 'INACTIVE' if status == 'INACTIVE' else 'ACTIVE'
+        # index: {'updated': datetime, 'families': {family: [latest ARN, count of revisions, highest known revision]}}
+        index_key = self._family_index_key(revision_status)
+        index = self.task_definition_family_index.get(index_key) if self.use_cache else None
+        now = datetime.now(timezone.utc)
+        if not index or 'updated' not in index or index['updated'] <= now - FAMILY_INDEX_TTL:
+            index = {'updated': now, 'families': {}}
+
+        def refresh(familly):
+            last, count, high_water_mark = index['families'].get(familly, ('EMPTY', 0, 0))
+            newest, new_count = self._list_family_revisions(familly, high_water_mark, revision_status)
+            if newest is None:
+                return ['EMPTY', 0, 0]
+            revision = int(newest.rsplit(':', 1)[-1])
+            if revision < high_water_mark:
+                # The latest counted revision is gone, count the family again.
+                newest, new_count = self._list_family_revisions(familly, 0, revision_status)
+                if newest is None:
+                    return ['EMPTY', 0, 0]
+                count, revision = 0, int(newest.rsplit(':', 1)[-1])
+            if revision == high_water_mark:
+                return [last, count, high_water_mark]
+            return [newest, count + new_count, revision]
+
+        out = []
+        for familly, entry in zip(families, self.fan_out(refresh, families)):
+            index['families'][familly] = entry
+            out.append((familly, entry[0], entry[1]))
+        self.task_definition_family_index.set(index_key, index)
         return out
 
     def all_task_definitions(self, family_prefix=None, status='ALL'):
@@ -1114,17 +1424,16 @@ class BotoWrapper:
                 task_definition = 'arn:aws:ecs:{}:{}:task-definition/{}:{}'.format(
                     _region, _account_id, _task_definition, int(_version) - 1)
         elif version == 'latest':
-            _familie = self.all_task_definition_families(_task_definition)
-            if _familie:
-                _familly_name, _last_task, _count = _familie[0]
-                task_definition = _last_task
-        else:
-            _familie = self.all_task_definition_families(_task_definition)
-            if _familie:
-                _familly_name, _last_task, _count = _familie[0]
-                if 0 < int(version) <= _count:
-                    task_definition = 'arn:aws:ecs:{}:{}:task-definition/{}:{}'.format(
-                        _region, _account_id, _task_definition, version)
+            task_definition = self.describe_task_definition(_task_definition, cluster)['taskDefinitionArn']
+        elif int(version) > 0:
+            _task_definition_arn = 'arn:aws:ecs:{}:{}:task-definition/{}:{}'.format(
+                _region, _account_id, _task_definition, version)
+            try:
+                self.describe_task_definition(_task_definition_arn, cluster)
+            except ClientError:
+                pass
+            else:
+                task_definition = _task_definition_arn
 
         return task_definition
 
@@ -1141,14 +1450,38 @@ class BotoWrapper:
             task['containerInstance'] = output_ec2
         return task
 
-    def describe_task_definition(self, task_definition, cluster='default', tags=False):
-        resp = self.ecs_client.describe_task_definition(
-            taskDefinition=task_definition,
-        )
+    def describe_task_definition(self, task_definition, cluster='default', tags=False, cached=True):
+        """Describe a task definition.
+
+        Only `family:revision` lookups are cached (a bare family always points
+        to the latest revision), and only their immutable body: a cached
+        response has no `TASK_DEFINITION_MUTABLE_FIELDS`. Callers which show
+        the status pass `cached=False`.
+        """
+        revision = TASK_DEFINITION_REVISION.match(task_definition)
+        resp = self.task_definition_cache.get(task_definition) if revision and cached else None
+        if resp is None:
+            resp = self.ecs_client.describe_task_definition(
+                taskDefinition=task_definition,
+            )
+            if revision:
+                resp.pop('ResponseMetadata', None)
+                body = dict(resp, taskDefinition={k: v for k, v in resp['taskDefinition'].items()
+                                                  if k not in TASK_DEFINITION_MUTABLE_FIELDS})
+                arn = resp['taskDefinition']['taskDefinitionArn']
+                self.task_definition_cache.set(arn, body)
+                if arn != task_definition:
+                    self.task_definition_cache.memo(task_definition, body)
         if tags:
             return resp['taskDefinition'], resp.get('tags', [])
         return resp['taskDefinition']
 
+    def describe_task_definitions(self, task_definitions, cluster='default'):
+        """Describe every distinct task definition once, concurrently. Returns {task definition: data}."""
+        task_definitions = list(dict.fromkeys(task_definitions))
+        responses = self.fan_out(lambda td: self.describe_task_definition(td, cluster=cluster), task_definitions)
+        return dict(zip(task_definitions, responses))
+
     def describe_object(self, data, export, obj='TaskDefinition', **kwargs):
         tmpl = getattr(template, obj)(json=data, clean=export, **kwargs)
         return tmpl.to_file()
@@ -1244,6 +1577,8 @@ class BotoWrapper:
         end_time = int(kwargs.get('end_time').timestamp()) * 1000 if kwargs.get('end_time') else None
         filter_pattern = kwargs.get('filter')
         byte_size = kwargs.get('byte_size')
+        grep_pattern = kwargs.get('grep_pattern')
+        json_where = kwargs.get('json_where') or ()
 
         try:
             _task = self.describe_task(task, cluster=cluster, simple=True)
@@ -1283,16 +1618,17 @@ class BotoWrapper:
                 ', '.join(containers)), True
         elif awslogs_group:
             prefix = awslogs_stream[0] if container else None
-            count_event, count_stream = 0, 0
+            count_event = 0
 
             if filter_pattern:
-                for event in self.__filter_log_events(awslogs_group[0], start_time, end_time, prefix, filter_pattern):
+                events = self.__filter_log_events(awslogs_group[0], start_time, end_time, prefix, filter_pattern)
+                for event in grep.filter_events(events, grep_pattern, json_where):
                     templ = self.__log_message(event)
                     count_event += 1
                     print(templ)
                 return 'NUMBER OF LOGS: {}'.format(count_event), False
             else:
-                events, selected_task = [], None
+                selected_task = None
                 if not prefix and len(awslogs_stream) == 1 and len(containers) == 1:
                     selected_task = '{}/{}/{}'.format(awslogs_stream[0], containers[0], task)
                 # logStreamNamePrefix: {awslogs_stream_prefix}/{container_definitions.name}/{id}
@@ -1304,21 +1640,15 @@ class BotoWrapper:
                 if not start_time and not end_time:
                     from_head = False
 
-                for stream in streams:
-                    count_stream += 1
-                    for event in self.__get_log_events(
-                            awslogs_group[0], stream['logStreamName'], start_time=start_time, end_time=end_time, from_head=from_head):
-                        event['logStreamName'] = stream['logStreamName']
-                        count_event += 1
-                        templ = self.__log_message(event)
-                        if not from_head:
-                            print(templ)
-                        else:
-                            events.append((self.__convert_date(event.get('timestamp')), templ))
-                if events:
-                    events = sorted(events, key=lambda k: k[0])
-                    for event in events:
-                        print(event[1])
+                events = [logstream.PrefetchedStream(self.executor, partial(
+                    self.__get_log_events_page, awslogs_group[0], stream['logStreamName'], start_time=start_time,
+                    end_time=end_time, from_head=from_head)) for stream in streams]
+                if from_head:
+                    events = logstream.merge_events(events)
+                else:
+                    events = itertools.chain.from_iterable(events)
+                for event in grep.filter_events(events, grep_pattern, json_where):
+                    print(self.__log_message(event))
                 return '', False
         return "This task don\'t usage CloudWatch Logs.", False
 
@@ -1326,10 +1656,7 @@ class BotoWrapper:
         return datetime.fromtimestamp(int(str(unixformat)[:-3])).strftime('%Y-%m-%d %H:%M:%S')
 
     def __log_message(self, event):
-        container_name = '\033[94m[{}]\033[0m '.format(event.get('logStreamName').split('/')[0])
-        timestamp = '\033[93m{}\033[0m '.format(self.__convert_date(event.get('timestamp')))
-        message = event.get('message')
-        return '{}{}{}'.format(container_name, timestamp, message)
+        return logstream.format_event(event)
 
     def __filter_log_events(self, log_group, start_time=None, end_time=None, log_prefix=None, filter_pattern=None):
         """Generate all the log events from a CloudWatch group.
@@ -1368,7 +1695,8 @@ class BotoWrapper:
             except KeyError:
                 break
 
-    def __get_log_events(self, log_group, log_stream, start_time=None, end_time=None, from_head=True):
+    def __get_log_events_page(self, log_group, log_stream, token=None, start_time=None, end_time=None,
+                              from_head=True):
         kwargs = {
             'logGroupName': log_group,
             'logStreamName': log_stream,
@@ -1376,23 +1704,33 @@ class BotoWrapper:
             'limit': 500
         }
 
+        if token:
+            kwargs['nextToken'] = token
         if start_time is not None:
             kwargs['startTime'] = start_time
         if end_time is not None:
             kwargs['endTime'] = end_time
 
-        while True:
-            resp = self.logs_client.get_log_events(**kwargs)
+        resp = self.logs_client.get_log_events(**kwargs)
+        for event in resp['events']:
+            event['logStreamName'] = log_stream
 
-            yield from resp['events']
+        # Without a time window only the latest page is shown.
+        if not from_head or not resp['events']:
+            return resp['events'], None
+        return resp['events'], resp.get('nextForwardToken')
 
-            try:
-                kwargs['nextToken'] = resp['nextForwardToken']
-            except KeyError:
+    def log_events(self, log_group, log_stream, start_time=None, end_time=None):
+        """Every event of a stream in `[start_time, end_time)`, oldest first."""
+        token = None
+        while True:
+            events, token = self.__get_log_events_page(log_group, log_stream, token, start_time, end_time)
+            yield from events
+            if token is None:
                 break
 
-            if not from_head or not resp['events']:
-                break
+    def log_streams(self, log_group, prefix):
+        return list(self.__describe_log_streams(log_group, prefix))
 
     def __describe_log_streams(self, log_group, prefix=None, selected_task=None):
         kwargs = {